@@ -0,0 +1,391 @@
+#------------------------------------------------------------------------------
+# MODULE: crutem_io.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+# Dataframe libraries:
+import numpy as np
+import pandas as pd
+import pickle
+import os
+import json
+from functools import lru_cache
+from exposure_bias_store import read_frame, write_frame
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# SETTINGS:
+#------------------------------------------------------------------------------
+
+scale_factor = 1000             # CRUTEM scaled integer format --> value x1000
+fill_value = -999               # CRUTEM fill value
+buffer_size = 4 * 1024 * 1024   # bytes written per chunk
+field_min, field_max = -9999, 99999 # integers that fit the 5 character field
+row_width = 64                  # characters of a data row: %4d year + 12 x %5d
+stat4_encoding = 'ISO-8859-1'
+stat4_index_suffix = '.index.pkl' # station index persisted next to the stat4 file
+binary_dtype = np.float32       # binary (member, station, year, month) cube: full precision, NaN fill
+stations_suffix = '.stations.parquet' # station metadata sidecar of a binary cube
+attrs_suffix = '.json'          # axes and variable of a binary cube
+read_chunk_bytes = 16 * 1024 * 1024 # bytes of a memory-mapped CRUTEM file decoded per chunk
+
+#------------------------------------------------------------------------------
+# METHODS
+#------------------------------------------------------------------------------
+
+def to_crutem_integers( station_data ):
+
+    '''
+    Scale values to CRUTEM integers: int( x*1000 ) with NaN --> -999.
+    '''
+
+    station_data = np.asarray( station_data, dtype=float )
+    valid = ~np.isnan( station_data )
+
+    values = np.full( station_data.shape, fill_value, dtype=np.int64 )
+    values[ valid ] = ( station_data[ valid ] * scale_factor ).astype( np.int64 )
+
+    return values
+
+@lru_cache(maxsize=None)
+def field_table():
+
+    '''
+    Lookup table of the 5 character right-aligned CRUTEM field ( %5d ) for
+    every integer in [-9999,99999], built once by integer arithmetic.
+    '''
+
+    values = np.arange( field_min, field_max + 1 )
+    magnitude = np.abs( values )
+    ndigits = 1 + sum( ( magnitude >= 10**k ).astype(int) for k in range(1,5) )
+
+    table = np.full( ( len( values ), 5 ), ord(' '), dtype=np.uint8 )
+    for k in range(5):
+        table[:,4-k] = np.where( k < ndigits, ord('0') + ( magnitude // 10**k ) % 10, table[:,4-k] )
+    for k in range(4):
+        table[:,k] = np.where( ( values < 0 ) & ( 4 - ndigits == k ), ord('-'), table[:,k] )
+    table.flags.writeable = False
+
+    return table
+
+def format_rows( station_years, values ):
+
+    '''
+    Build fixed-width CRUTEM rows ( year + 12 x %5d ) from integer arrays as
+    a (years, 65) byte array by a single lookup into the field table.
+    '''
+
+    table = field_table()
+    nyears = len( station_years )
+
+    rows = np.empty( ( nyears, 65 ), dtype=np.uint8 )
+    rows[:,0:4] = table[ np.asarray( station_years ) - field_min, 1: ]
+    rows[:,4:64] = table[ values - field_min ].reshape( nyears, 60 )
+    rows[:,64] = ord('\n')
+
+    return rows
+
+def format_station( station_header, station_years, station_data ):
+
+    '''
+    Render a station block in CRUTEM format: the header line followed by
+    one row per year of the year and 12 monthly scaled integers ( width 5 ).
+    The whole (years, 12) block is formatted in a single step.
+    '''
+
+    values = to_crutem_integers( station_data ).reshape( len( station_years ), 12 )
+    years = np.asarray( station_years, dtype=np.int64 )
+
+    if ( values.min() >= field_min ) & ( values.max() <= field_max ) & ( years.min() >= 1000 ) & ( years.max() <= 9999 ):
+        return station_header + format_rows( years, values ).tobytes().decode('ascii')
+
+    # FALLBACK: values wider than the CRUTEM field --> printf formatting of the block
+
+    rows = np.column_stack( [ years, values ] )
+    rowfmt = '%d' + '%5d' * 12 + '\n'
+
+    return station_header + ( rowfmt * len( rows ) ) % tuple( rows.ravel().tolist() )
+
+def open_crutem( filename ):
+
+    '''
+    Open a CRUTEM format file for writing with a large write buffer.
+    '''
+
+    return open( filename, 'w', buffering=buffer_size )
+
+def is_data_row( line ):
+
+    '''
+    Fixed-width CRUTEM data row: %4d year + 12 x %5d values with no
+    separator ( values <= -1000 run into the previous field ).
+    '''
+
+    row = line.rstrip('\r\n')
+    if len( row ) != row_width: return False
+    fields = [ row[0:4] ] + [ row[4+5*k:9+5*k] for k in range(12) ]
+    digits = [ field.strip()[1:] if field.strip().startswith('-') else field.strip() for field in fields ]
+    return all( digit.isdigit() and ( field.rstrip() == field ) for field, digit in zip( fields, digits ) )
+
+def is_header( line ):
+
+    '''
+    stat4 header rule: any non-empty line that is not a year followed by
+    12 monthly values ( whitespace separated, or a fixed-width data row ).
+    '''
+
+    if is_data_row( line ): return False
+    return ( len(line.strip().split())!=13 ) | ( len(line.split()[0])>4 )
+
+def header_coordinate( field ):
+
+    '''
+    Latitude / longitude field of a station header ( tenths of a degree ) in
+    degrees: NaN if the field is not an integer.
+    '''
+
+    try:
+        return int( field ) / 10.0
+    except ValueError:
+        return np.nan
+
+def build_stat4_index( stat4file ):
+
+    '''
+    Scan a stat4 file once and index its station blocks.
+
+    Returns: dataframe with one row per station: stationcode, lat, lon,
+    header ( text as read in text mode ), offset and length ( bytes ) of the block
+    '''
+
+    stationcodes = []
+    lats = []
+    lons = []
+    headers = []
+    offsets = []
+
+    offset = 0
+    with open( stat4file, 'rb' ) as f:
+        for raw in f:
+            line = raw.decode( stat4_encoding ).replace('\r\n','\n')
+            if len(line)>1: # ignore empty lines
+                if is_header( line ): # header lines
+                    stationcodes.append( line[0:6] )
+                    lats.append( header_coordinate( line[6:10] ) )
+                    lons.append( header_coordinate( line[10:15] ) )
+                    headers.append( line )
+                    offsets.append( offset )
+            offset += len( raw )
+
+    malformed = [ code for code, lat, lon in zip( stationcodes, lats, lons ) if np.isnan( lat ) | np.isnan( lon ) ]
+    if len( malformed ) > 0:
+        print( stat4file + ': ' + str( len( malformed ) ) + ' station header(s) with malformed lat / lon ( set to NaN ): ' + ', '.join( malformed[:10] ) )
+
+    offsets = np.array( offsets, dtype=np.int64 )
+    lengths = np.diff( np.append( offsets, offset ) )
+
+    return pd.DataFrame( {'stationcode':stationcodes, 'lat':lats, 'lon':lons, 'header':headers, 'offset':offsets, 'length':lengths} )
+
+def read_stat4_index( stat4file ):
+
+    '''
+    Load the station index of a stat4 file, rebuilding and persisting it
+    next to the source ( stat4file + '.index.pkl' ) if the stat4 mtime or
+    size has changed since it was built.
+    '''
+
+    stat = os.stat( stat4file )
+    indexfile = stat4file + stat4_index_suffix
+
+    if os.path.exists( indexfile ):
+        try:
+            with open( indexfile, 'rb' ) as f:
+                cache = pickle.load( f )
+            if ( cache['mtime_ns'] == stat.st_mtime_ns ) & ( cache['size'] == stat.st_size ):
+                return cache['index']
+        except ( OSError, EOFError, KeyError, pickle.UnpicklingError ):
+            pass
+
+    df_index = build_stat4_index( stat4file )
+
+    # SAVE: via a per-process temporary file and an atomic rename ( concurrent stages may rebuild the same index )
+
+    tmpfile = indexfile + '.' + str( os.getpid() ) + '.tmp'
+    try:
+        with open( tmpfile, 'wb' ) as f:
+            pickle.dump( {'mtime_ns':stat.st_mtime_ns, 'size':stat.st_size, 'index':df_index}, f, protocol=pickle.HIGHEST_PROTOCOL )
+        os.replace( tmpfile, indexfile )
+    except OSError:
+        pass # read-only location --> index is rebuilt on the next run
+
+    return df_index
+
+def read_block( f, offset, length ):
+
+    '''
+    Station block of an open ( binary ) CRUTEM file as text.
+    '''
+
+    f.seek( offset )
+    return f.read( length ).decode( stat4_encoding ).replace('\r\n','\n')
+
+def scan_lines( buf, base ):
+
+    '''
+    Split a block of CRUTEM bytes into lines and decode the fixed-width data
+    rows ( row_width characters: %4d year + 12 x %5d ) by column in bulk:
+    each field is validated as a right-aligned integer and its digits
+    weighted by position, so rows with merged fields ( values <= -1000 )
+    decode like any other.
+
+    base: file offset of the block
+    Returns: line kind ( 0 = empty, 1 = other, 2 = data ), byte ranges
+    ( file offsets ) of the other lines and (data rows, 13) int64 year +
+    monthly values
+    '''
+
+    newlines = np.flatnonzero( buf == ord('\n') )
+    ends = newlines if ( len( buf ) == 0 ) or ( buf[-1] == ord('\n') ) else np.append( newlines, len( buf ) )
+    starts = np.concatenate( [ [ 0 ], newlines + 1 ] )[:len( ends )]
+    ends = ends - ( ( ends > starts ) & ( buf[ np.maximum( ends - 1, 0 ) ] == ord('\r') ) ) # drop the CR of CRLF
+
+    # FIELDS: (rows, 13, 5) bytes of every line of data row width ( year padded to 5 )
+
+    candidates = np.flatnonzero( ends - starts == row_width )
+    chars = np.full( ( len( candidates ), 65 ), ord(' '), dtype=np.uint8 )
+    chars[:,1:] = buf[ starts[ candidates ][:,np.newaxis] + np.arange( row_width ) ]
+    chars = chars.reshape( -1, 13, 5 )
+
+    space = chars == ord(' ')
+    digit = ( chars >= ord('0') ) & ( chars <= ord('9') )
+    minus = chars == ord('-')
+    seen = np.logical_or.accumulate( ~space, axis=2 )
+    first = seen & ~np.concatenate( [ np.zeros( seen.shape[:2] + (1,), dtype=bool ), seen[:,:,:-1] ], axis=2 )
+    valid = ( np.where( seen, digit | ( minus & first ), True ).all( axis=2 ) & digit[:,:,-1] ).all( axis=1 )
+
+    chars = chars[ valid ]
+    weights = 10 ** np.arange( 4, -1, -1 )
+    values = ( np.where( digit[ valid ], chars.astype( np.int64 ) - ord('0'), 0 ) * weights ).sum( axis=2 )
+    values[ minus[ valid ].any( axis=2 ) ] *= -1
+
+    kind = np.where( ends > starts, 1, 0 ).astype( np.int8 )
+    kind[ candidates[ valid ] ] = 2
+    other = kind == 1
+
+    return kind, np.column_stack( [ starts[ other ], ends[ other ] ] ) + base, values
+
+def read_crutem( filename, t_start=None, t_end=None, dtype=np.int32 ):
+
+    '''
+    Read a CRUTEM format file ( stat4, model or ensemble member output )
+    into arrays without per-row parsing: the file is memory-mapped and
+    decoded in blocks of read_chunk_bytes, data rows are decoded by column
+    and every row is scattered into a (station, year, 12) array of scaled
+    integers in one step. The remaining lines are station headers ( stat4
+    header rule, one decode per station ).
+
+    t_start, t_end: year axis [t_start, t_end) ( None --> years in the file )
+    dtype: integer dtype of the values ( np.int16 for x1000 exposure bias )
+    Returns: station dataframe ( stationcode, lat, lon, header ), years,
+    values (station, year, 12) with fill_value where missing, mask ( True
+    where missing )
+    '''
+
+    size = os.path.getsize( filename )
+    buf = np.memmap( filename, dtype=np.uint8, mode='r' ) if size > 0 else np.zeros( 0, dtype=np.uint8 )
+
+    kinds = []
+    other_ranges = []
+    rows = []
+    start = 0
+    while start < size:
+        stop = min( start + read_chunk_bytes, size )
+        if stop < size:
+            newlines = np.flatnonzero( buf[ start:stop ] == ord('\n') )
+            stop = start + newlines[-1] + 1 if len( newlines ) > 0 else size
+        kind, ranges, values = scan_lines( np.asarray( buf[ start:stop ] ), start )
+        kinds.append( kind )
+        other_ranges.append( ranges )
+        rows.append( values )
+        start = stop
+
+    kind = np.concatenate( kinds ) if len( kinds ) > 0 else np.zeros( 0, dtype=np.int8 )
+    other_ranges = np.concatenate( other_ranges ) if len( other_ranges ) > 0 else np.zeros( ( 0, 2 ), dtype=np.int64 )
+    rows = np.concatenate( rows ) if len( rows ) > 0 else np.zeros( ( 0, 13 ), dtype=np.int64 )
+
+    # HEADERS: the other lines are station headers ( blank lines ignored, anything else is malformed )
+
+    lines = [ bytes( buf[ a:b ] ).decode( stat4_encoding ) + '\n' for a, b in other_ranges ]
+    blank = np.array( [ len( line.strip() ) == 0 for line in lines ], dtype=bool )
+    for ( a, b ), line in zip( other_ranges, lines ):
+        if ( len( line.strip() ) > 0 ) and not is_header( line ):
+            raise ValueError( filename + ': data row at byte ' + str( a ) + ' is not fixed width ( %4d + 12 x %5d ): ' + line.strip() )
+    kind[ np.flatnonzero( kind == 1 )[ blank ] ] = 0
+    headers = [ line for line, empty in zip( lines, blank ) if not empty ]
+
+    df_stations = pd.DataFrame( {'stationcode':[ line[0:6] for line in headers ], 'lat':[ header_coordinate( line[6:10] ) for line in headers ], 'lon':[ header_coordinate( line[10:15] ) for line in headers ], 'header':headers} )
+
+    # SCATTER: data rows to (station, year) of the preceding header ( rows before the first header are dropped )
+
+    station = ( np.cumsum( kind == 1 ) - 1 )[ kind == 2 ]
+    years = rows[:,0]
+    if t_start is None: t_start = int( years.min() ) if len( years ) > 0 else 0
+    if t_end is None: t_end = int( years.max() ) + 1 if len( years ) > 0 else t_start
+    keep = ( station >= 0 ) & ( years >= t_start ) & ( years < t_end )
+
+    info = np.iinfo( dtype )
+    if ( len( rows ) > 0 ) and ( ( rows[ keep, 1: ].min( initial=0 ) < info.min ) | ( rows[ keep, 1: ].max( initial=0 ) > info.max ) ):
+        raise ValueError( 'CRUTEM values of ' + filename + ' do not fit ' + np.dtype( dtype ).name )
+
+    values = np.full( ( len( df_stations ), t_end - t_start, 12 ), fill_value, dtype=dtype )
+    values[ station[ keep ], years[ keep ] - t_start ] = rows[ keep, 1: ]
+
+    return df_stations, np.arange( t_start, t_end ), values, values == fill_value
+
+def open_binary( stem, df_stat4, members, t_start, t_end, variable, dtype=binary_dtype ):
+
+    '''
+    Create a binary cube alongside the CRUTEM text output: stem + '.npy'
+    ( float32 (member, station, year, month), memory-mappable ), a station
+    metadata sidecar stem + '.stations.parquet' ( stationcode, lat, lon,
+    header in cube station order ) and stem + '.json' ( axes, variable ).
+    The caller fills every station.
+
+    members: labels of the cube member axis ( 1-based member numbers, or
+    statistic names )
+    dtype: integer dtype --> CRUTEM scaled integers ( x1000, fill = -999 )
+    Returns: writable memory-mapped cube
+    '''
+
+    members = [ member if isinstance( member, str ) else int( member ) for member in members ]
+    nyears = t_end - t_start
+
+    attrs = {'variable':variable, 'units':'degC', 'dims':[ 'member', 'station', 'year', 'month' ], 'members':members, 't_start':t_start, 't_end':t_end, 'fill_value':'NaN'}
+    if np.issubdtype( dtype, np.integer ):
+        attrs.update( {'scale_factor':scale_factor, 'fill_value':fill_value} )
+
+    write_frame( df_stat4[ [ 'stationcode', 'lat', 'lon', 'header' ] ].reset_index(drop=True), stem + stations_suffix )
+    with open( stem + attrs_suffix, 'w' ) as f:
+        json.dump( attrs, f )
+
+    return np.lib.format.open_memmap( stem + '.npy', mode='w+', dtype=dtype, shape=( len( members ), len( df_stat4 ), nyears, 12 ) )
+
+def read_binary( stem ):
+
+    '''
+    Memory-map a binary cube written by open_binary.
+
+    Returns: cube ( read-only memmap ), station metadata dataframe, attributes
+    '''
+
+    with open( stem + attrs_suffix, 'r' ) as f:
+        attrs = json.load( f )
+
+    return np.load( stem + '.npy', mmap_mode='r' ), read_frame( stem + stations_suffix ), attrs
+
+#------------------------------------------------------------------------------
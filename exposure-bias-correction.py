@@ -16,9 +16,15 @@
 import numpy as np
 import pandas as pd
 import pickle
+import os
+from exposure_bias_store import read_frame, write_frame, iter_frame, write_frame_chunks, locate_frame
+from exposure_bias_manifest import file_hash, station_hashes, incremental_stations, write_manifest
+from exposure_bias_cube import load_cube, cube_means, accumulate_cubes, merge_cubes, save_cube
 # Plotting libraries:
 import matplotlib.pyplot as plt
 import seaborn as sns; sns.set()
+# Exposure bias correction engine:
+from exposure_bias_engine import apply_exposure_bias, stream_exposure_bias, parallel_exposure_bias, patch_exposure_bias, correct_stations, patch_chunks
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
@@ -27,115 +33,156 @@ import seaborn as sns; sns.set()
 
 fontsize = 16
 
-df_temp_file = 'DATA/df_temp_qc.pkl'
-df_ebm_file = 'DATA/df_exposure_bias.pkl'
+df_temp_file = 'DATA/df_temp_qc.parquet'
+df_ebm_file = 'DATA/df_exposure_bias.parquet'
 
-df_temp_ebc_file = 'df_temp_ebc.pkl'
-df_ebc_file = 'df_ebc.pkl'
+df_temp_ebc_file = 'df_temp_ebc.parquet'
+df_ebc_file = 'df_ebc.parquet'
 
 tstart, tend = 1781, 2022
 
-#------------------------------------------------------------------------------
-# LOAD: temperature .pkl file
+use_streaming = False           # (default=False) True --> correct df_temp in chunks of chunk_rows rows ( Parquet output )
+chunk_rows = 1000000            # station-year rows per chunk ( sets peak memory in streaming mode )
+nworkers = 1                    # (default=1) >1 --> stations sharded across a process pool ( None --> all cores )
+use_incremental = True          # (default=True) True --> recompute only stations whose model rows changed since the last run
+
 #------------------------------------------------------------------------------
 
-df_temp = pd.read_pickle( df_temp_file, compression='bz2' )
+def main():
 
-# TRIM: to GloSAT year range [1781,2022]
+    #------------------------------------------------------------------------------
+    # LOAD: exposure bias model file
+    #------------------------------------------------------------------------------
 
-df_temp = df_temp[ ( df_temp.year >= tstart ) & ( df_temp.year <= tend ) ]
-stationcodes_temp = df_temp.stationcode.unique()
+    df_ebm = read_frame( df_ebm_file, columns=[ 'datetime', 'stationcode', 'bias', 'uncertainty', 'exposurecorrected_flag' ] )
+    df_ebm['bias'] = df_ebm['bias'].replace( np.nan, 0.0 )
+    stationcodes_ebm = df_ebm.stationcode.unique()
 
-#------------------------------------------------------------------------------
-# LOAD: exposure bias model .pkl file
-#------------------------------------------------------------------------------
+    #------------------------------------------------------------------------------
+    # CONDITIONS: exposure bias = 0 if source_flag = 3 | exposurecorrected_flag = 1
+    #------------------------------------------------------------------------------
 
-df_ebm = pd.read_pickle( df_ebm_file, compression='bz2' )
-df_ebm['bias'] = df_ebm['bias'].replace( np.nan, 0.0 )
-stationcodes_ebm = df_ebm.stationcode.unique()
+    # SET: bias to zero on conditions
 
-#------------------------------------------------------------------------------
-# CONDITIONS: exposure bias = 0 if source_flag = 3 | exposurecorrected_flag = 1
-#------------------------------------------------------------------------------
+    #df_ebm['bias'].loc[ df_ebm['source_flag'] > 2 ] = 0.0 # no correction if source_flag = 3
+    df_ebm.loc[ df_ebm['exposurecorrected_flag'] == 1, 'bias' ] = 0.0 # no correction if already corrected
 
-# SET: bias to zero on conditions
+    # SET: uncertainty to zero on conditions
 
-#df_ebm['bias'].loc[ df_ebm['source_flag'] > 2 ] = 0.0 # no correction if source_flag = 3
-df_ebm['bias'].loc[ df_ebm['exposurecorrected_flag'] == 1 ] = 0.0 # no correction if already corrected
-       
-# SET: uncertainty to zero on conditions
+    #df_ebm['uncertainty'].loc[ df_ebm['source_flag'] > 2 ] = np.nan # fill value if source_flag = 3
+    df_ebm.loc[ df_ebm['exposurecorrected_flag'] == 1, 'uncertainty' ] = np.nan # fill value if already corrected
 
-#df_ebm['uncertainty'].loc[ df_ebm['source_flag'] > 2 ] = np.nan # fill value if source_flag = 3
-df_ebm['uncertainty'].loc[ df_ebm['exposurecorrected_flag'] == 1 ] = np.nan # fill value if already corrected
+    #------------------------------------------------------------------------------
+    # INCREMENTAL: stations whose applied bias changed since the outputs were written ( None --> all )
+    #------------------------------------------------------------------------------
 
-#------------------------------------------------------------------------------
-# INITIALISE: exposure bias correction dataframe
-#------------------------------------------------------------------------------
+    # HASH: datetime and bias after the conditions ( uncertainty does not enter df_ebc or df_temp_ebc )
 
-df_ebc = df_temp.copy()
-for i in range(1,13): df_ebc[str(i)] = 0.0
+    sources = {'df_temp':file_hash( locate_frame( df_temp_file ) ), 'tstart':tstart, 'tend':tend}
+    stations = station_hashes( df_ebm, [ 'datetime', 'bias' ] )
+    changed = incremental_stations( df_ebc_file, sources, stations ) if ( use_incremental == True ) & os.path.exists( df_temp_ebc_file ) else None
 
-#------------------------------------------------------------------------------
-# BIAS CORRECT: temperature dataframe with EBM values
-#------------------------------------------------------------------------------
+    #------------------------------------------------------------------------------
+    # BIAS CORRECT: temperature dataframe with EBM values
+    #------------------------------------------------------------------------------
 
-df_temp_ebc = df_temp.copy()
+    ebc_cube = None # aggregation cube of df_ebc for the plot ( None --> load_cube from the saved file )
 
-for k in range( len( stationcodes_temp ) ):
-     
-    if stationcodes_temp[k] in stationcodes_ebm:        
-        
-        da = df_ebm[ df_ebm.stationcode == stationcodes_temp[k] ].reset_index(drop=True)
-        da.datetime = pd.date_range(start=str(da.datetime.loc[0].year), periods=len(da), freq='M')
-        
-        idx = df_temp_ebc[ df_temp_ebc.stationcode == stationcodes_temp[k] ].index.values
+    if ( changed is not None ) and ( len( changed ) == 0 ):
 
-        # ADD: EBC to temperature data
+        # UP TO DATE: no station changed --> the existing outputs are kept as they are
 
-        for i in range(1,13): 
-            
-            df_temp_ebc[str(i)][idx] = np.array( df_temp_ebc[str(i)][idx] ) + np.array( da[da.datetime.dt.month == i].bias.values )
-            df_ebc[str(i)][idx] = np.array( df_ebc[str(i)][idx] ) + np.array( da[da.datetime.dt.month == i].bias.values )
- 
-#    else: continue
-        
-    if k % 10 == 0: print(k)
+        print( 'stations recomputed:', 0 )
 
-#------------------------------------------------------------------------------
-# SAVE: exposure bias corrected temperature dataframe .pkl file
-#------------------------------------------------------------------------------
+    elif changed is not None:
 
-df_temp_ebc.to_pickle( df_temp_ebc_file, compression='bz2' )
+        # PATCH: recorrect only the changed stations' rows of the existing outputs
 
-#------------------------------------------------------------------------------
-# SAVE: exposure bias corrections dataframe .pkl file
-#------------------------------------------------------------------------------
+        df_temp = read_frame( df_temp_file, stationcodes=changed, years=( tstart, tend ) )
+        if use_streaming == True:
 
-df_ebc.to_pickle( df_ebc_file, compression='bz2' )
+            # STREAM: each output rewritten chunk by chunk with the changed rows replaced ( only the changed stations are held in memory )
 
-#------------------------------------------------------------------------------
-# PLOT: global mean EBC
-#------------------------------------------------------------------------------
+            patches = correct_stations( df_temp, df_ebm, changed )
+            ebc_cubes = []
+            for path, patch, cubes in zip( [ df_temp_ebc_file, df_ebc_file ], patches, [ [], ebc_cubes ] ):
+                root, extension = os.path.splitext( path )
+                tmpfile = root + '.tmp' + extension
+                write_frame_chunks( accumulate_cubes( patch_chunks( iter_frame( path, chunk_rows ), changed, patch ), 0, cubes ), [ tmpfile ] )
+                os.replace( tmpfile, path )
+            ebc_cube = merge_cubes( ebc_cubes )
+            save_cube( df_ebc_file, ebc_cube )
 
-figstr = 'global-mean-ebc-monthly.png'
-titlestr = 'Global mean EBC: N(corrected stations)=' + str(stationcodes_ebm.shape[0])    
-xstr = 'Year'
-ystr = 'Bias, °C'
-
-fig, ax = plt.subplots(figsize=(15,10))          
-for i in range(12):    
-    plt.plot( df_ebc.groupby('year').mean().iloc[:,i], label='Month '+str(i+1))
-plt.tick_params(labelsize=fontsize)    
-plt.legend(loc='lower right', ncol=4, fontsize=12)
-plt.xlabel(xstr, fontsize=fontsize)
-plt.ylabel(ystr, fontsize=fontsize)
-plt.title(titlestr, fontsize=fontsize)
-plt.savefig(figstr, dpi=300, bbox_inches='tight')
-plt.close(fig)
-            
-#------------------------------------------------------------------------------
-print('** END')
+        else:
+
+            df_temp_ebc = read_frame( df_temp_ebc_file )
+            df_ebc = read_frame( df_ebc_file )
+            patch_exposure_bias( df_temp_ebc, df_ebc, df_temp, df_ebm, changed )
+            write_frame( df_temp_ebc, df_temp_ebc_file )
+            write_frame( df_ebc, df_ebc_file )
+        print( 'stations recomputed:', len( changed ) )
+
+    elif use_streaming == True:
+
+        # STREAM: chunks of df_temp rows ( trimmed to GloSAT year range [1781,2022] ) --> correct --> append to outputs
+
+        # CUBE: df_ebc aggregated chunk by chunk on the way out ( the plot never reloads the full frame )
+
+        temp_chunks = iter_frame( df_temp_file, chunk_rows, years=( tstart, tend ) )
+        ebc_cubes = []
+        write_frame_chunks( accumulate_cubes( stream_exposure_bias( temp_chunks, df_ebm ), 1, ebc_cubes ), [ df_temp_ebc_file, df_ebc_file ] )
+        ebc_cube = merge_cubes( ebc_cubes )
+        save_cube( df_ebc_file, ebc_cube )
+
+    else:
+
+        # LOAD: temperature file
+        # TRIM: to GloSAT year range [1781,2022] ( row groups outside the range are skipped on read )
+
+        df_temp = read_frame( df_temp_file, years=( tstart, tend ) )
+
+        # PIVOT: df_ebm to a (station, year, month) array once and ADD to all matching station-years in one aligned pass
+
+        if nworkers == 1:
+            df_temp_ebc, df_ebc = apply_exposure_bias( df_temp, df_ebm )
+        else:
+            df_temp_ebc, df_ebc = parallel_exposure_bias( df_temp, df_ebm, nworkers=nworkers )
+
+        # SAVE: exposure bias corrected temperature and exposure bias corrections dataframe files
+
+        write_frame( df_temp_ebc, df_temp_ebc_file )
+        write_frame( df_ebc, df_ebc_file )
+
+    write_manifest( df_ebc_file, sources, stations )
+
+    #------------------------------------------------------------------------------
+    # PLOT: global mean EBC
+    #------------------------------------------------------------------------------
+
+    figstr = 'global-mean-ebc-monthly.png'
+    titlestr = 'Global mean EBC: N(corrected stations)=' + str(stationcodes_ebm.shape[0])    
+    xstr = 'Year'
+    ystr = 'Bias, °C'
+
+    if ebc_cube is None:
+        ebc_cube = load_cube( df_ebc_file, chunk_rows if use_streaming == True else None ) # from the saved file
+    global_mean_ebc = cube_means( ebc_cube, 'GL' )
+
+    fig, ax = plt.subplots(figsize=(15,10))          
+    for i in range(12):    
+        plt.plot( global_mean_ebc.iloc[:,i], label='Month '+str(i+1))
+    plt.tick_params(labelsize=fontsize)    
+    plt.legend(loc='lower right', ncol=4, fontsize=12)
+    plt.xlabel(xstr, fontsize=fontsize)
+    plt.ylabel(ystr, fontsize=fontsize)
+    plt.title(titlestr, fontsize=fontsize)
+    plt.savefig(figstr, dpi=300, bbox_inches='tight')
+    plt.close(fig)
 
+# -----------------------------------------------------------------------------
+if __name__ == "__main__":
 
+    # GUARD: worker processes ( spawn start method ) import this script without running it
 
-    
+    main()
+    print('** END')
@@ -29,6 +29,9 @@ import random
 
 # Maths libraries
 import scipy
+from exposure_bias_ensemble import stream_equiprobable_bins, ensemble_seed, make_timeseries, regimes, station_regimes, write_large_ensemble
+# CRUTEM format:
+from crutem_io import format_station, open_crutem, read_stat4_index, open_binary
 
 # Silence library version notifications
 import warnings
@@ -38,7 +41,7 @@ warnings.filterwarnings("ignore", message="numpy.dtype size changed")
 warnings.filterwarnings("ignore", message="numpy.ufunc size changed")
 #------------------------------------------------------------------------------
 
-def generate_ensemble(member):
+def generate_ensemble(members=None, binary=False, nensemble=10, large=False, statistics=False, dtype=np.float32, seed=ensemble_seed):
 
     #------------------------------------------------------------------------------
     # SETTINGS: 
@@ -47,70 +50,19 @@ def generate_ensemble(member):
     t_start = 1781
     t_end = 2021
 
-    ndraws = 1000000
-    nensemble = 10
-
     stat4file = 'CRUTEM/stat4.txt'
+    files_per_pass = 128 # member files open at once ( a large --nensemble stays below the open-file limit )
 
-    #------------------------------------------------------------------------------
-    # METHODS
-    #------------------------------------------------------------------------------
-
-    def make_timeseries( uncertainty, taper_start, taper_end ):
-      
-        t_taper = pd.date_range( start = str( taper_start ), end = str( taper_end ), freq='M')
-        ts_taper = [ uncertainty / (len( t_taper ) - 1 ) * ( (len( t_taper ) - 1 ) - i ) for i in range( len( t_taper ) ) ]           
-        da =  pd.DataFrame( {'datetime':t_taper, 'bias':ts_taper} )
-
-        t_full = pd.date_range(start=str( t_start ), end=str( t_end ), freq='M')
-        df_full = pd.DataFrame( {'datetime':t_full} )
-        df = df_full.merge( da, how='left', on='datetime' )
-        df.bias[ df.datetime <= str( taper_start ) ] = uncertainty
-        df.bias[ df.datetime >= str( taper_end ) ] = 0.0
-
-        return df.bias.values
-
-    def generate_ensemble_member( nensemble, uncertainty ):
-
-        # equiprobable binning
-    
-        random_numbers = np.random.normal(loc=0, scale=uncertainty, size=ndraws)
-        bin_edges = np.linspace( -uncertainty, uncertainty, nensemble+1 )
-
-        bias_ensemble = []
-        for k in range(nensemble):    
-
-            random_numbers_bin = [ i for i in random_numbers if i > bin_edges[k] and i < bin_edges[k+1] ]
-            random_draw = np.random.randint(len(random_numbers_bin), size=1)[0]
-            random_bias = random_numbers_bin[ random_draw ]
-
-            bias_ensemble.append( random_bias )        
-
-        return bias_ensemble
+    if members is None: members = list( range( nensemble ) ) # all members in a single pass
 
     #------------------------------------------------------------------------------
     # LOAD: stat4 file and extract headers, stationcodes and latitudes
     #------------------------------------------------------------------------------
 
-    headerlist = []
-    stationcodelist = []
-    latlist = []
-    
-    with open (stat4file, 'r', encoding="ISO-8859-1") as f:                      
-        for line in f:   
-            if len(line)>1: # ignore empty lines         
-                if (len(line.strip().split())!=13) | (len(line.split()[0])>4): # header lines
-                    header = line
-                    code = line[0:6]                                                                
-                    lat = int(line[6:10]) / 10.0
-                    headerlist.append( header )
-                    stationcodelist.append( code )
-                    latlist.append( lat )                
-                else:           
-                    continue                                     
-            else:                
-                continue
-    f.close
+    df_stat4 = read_stat4_index( stat4file ) # station index cached next to stat4file
+    headerlist = list( df_stat4.header )
+    stationcodelist = list( df_stat4.stationcode )
+    latlist = list( df_stat4.lat )
 
     #------------------------------------------------------------------------------
     # HadCRUT5 Exposure Bias Model
@@ -125,64 +77,92 @@ def generate_ensemble(member):
     # 20N the exposure bias uncertainty takes a value of 0.1C
     # prior to 1900, decreasing linearly to zero by 1930.
         
-    exposure_bias_file = str(member+1).zfill(2) + '_hadcrut5_ensemble_exposure_bias.txt'
+    exposure_bias_files = [ str(member+1).zfill( max( 2, len( str( nensemble ) ) ) ) + '_hadcrut5_ensemble_exposure_bias.txt' for member in members ]
 
-    # Extratropics ensemble draw
-    
-    taper_start_extratropics = 1930
-    taper_end_extratropics = 1950
-    uncertainty = 0.2
-    bias_ensemble = generate_ensemble_member( nensemble, uncertainty )
-    bias_extratropics = bias_ensemble[member]
+    # DRAW: one realisation per (regime, member) from its own counter-based stream --> identical for any member subset
 
-    # Tropics ensemble draw
+    # Extratropics and tropics ensemble draws ( taper years and uncertainty from the shared regimes )
     
-    taper_start_tropics = 1900
-    taper_end_tropics = 1930
-    uncertainty = 0.1
-    bias_ensemble = generate_ensemble_member( nensemble, uncertainty )
-    bias_tropics = bias_ensemble[member]
+    ( taper_start_extratropics, taper_end_extratropics, uncertainty_extratropics ), ( taper_start_tropics, taper_end_tropics, uncertainty_tropics ) = regimes
+    bias_extratropics = stream_equiprobable_bins( uncertainty_extratropics, nensemble, [ 'extratropics' ], members, seed )[0]
+    bias_tropics = stream_equiprobable_bins( uncertainty_tropics, nensemble, [ 'tropics' ], members, seed )[0]
+
+    # LARGE ENSEMBLE: (member, station) biases drawn batch by batch from the regime streams --> one binary cube ( or its statistics )
+
+    regime = station_regimes( latlist )
+    if large == True:
+        draw_regimes = lambda batch: np.column_stack( [ stream_equiprobable_bins( uncertainty_extratropics, nensemble, [ 'extratropics' ], batch, seed )[0], stream_equiprobable_bins( uncertainty_tropics, nensemble, [ 'tropics' ], batch, seed )[0] ] )
+        draw = lambda batch, stations: draw_regimes( batch )[:,regime[ stations ]]
+        write_large_ensemble( 'hadcrut5_ensemble_exposure_bias_large', df_stat4, members, draw, regime, t_start, t_end, statistics, dtype )
+        return
 
-    with open(exposure_bias_file,'w') as f:
+    # CONSTRUCT: exposure bias timeseries per (member, regime) once --> identical for all stations in a regime
+
+    ts_extratropics = make_timeseries( bias_extratropics, taper_start_extratropics, taper_end_extratropics, t_start, t_end )
+    ts_tropics = make_timeseries( bias_tropics, taper_start_tropics, taper_end_tropics, t_start, t_end )
+
+    # BINARY: memory-mappable (member, station, year, month) cube + station sidecar alongside the text files
+
+    if binary == True:
+        binary_stem = 'hadcrut5_ensemble_exposure_bias' if len( members ) > 1 else os.path.splitext( exposure_bias_files[0] )[0]
+        cube = open_binary( binary_stem, df_stat4, [ member+1 for member in members ], t_start, t_end, 'exposure_bias' )
+
+    # WRITE: stream (member, month) blocks per station to the member files, files_per_pass member files at a time
+
+    for first in range( 0, len( members ), files_per_pass ):
+
+        group = slice( first, first + files_per_pass )
+        files = [ open_crutem(exposure_bias_file) for exposure_bias_file in exposure_bias_files[ group ] ]
         
         for k in range( len( stationcodelist ) ):
             
-            # CONSTRUCT: exposure bias timeseries
-            
             station_header = headerlist[k]    
-            lat = latlist[k]        
-            if ( lat < -20 ) | ( lat > 20 ): 
-                ts = make_timeseries( bias_extratropics, taper_start_extratropics, taper_end_extratropics )
+            if regime[k] == 0: 
+                ts_ensemble = ts_extratropics[ group ]
             else: 
-                ts = make_timeseries( bias_tropics, taper_start_tropics, taper_end_tropics )
-              
-            # EXTRACT: years and month data for CRUTEM format
+                ts_ensemble = ts_tropics[ group ]
+
+            for m in range( len( files ) ):
+
+                f = files[m]
+
+                # EXTRACT: years and month data for CRUTEM format
         
-            station_years = np.arange( t_start, t_end )    
-            station_data = np.reshape( ts, [ len( station_years ), 12 ] )
+                station_years = np.arange( t_start, t_end )    
+                station_data = np.reshape( ts_ensemble[m], [ len( station_years ), 12 ] )
               
-            # WRITE: station header + yearly rows of monthly values in CRUTEM format x1000
-    
-            f.write(station_header)
-            for i in range(len(station_years)):  
-                rowstr = str(station_years[i])
-                for j in range(12):
-                    if np.isnan(station_data[i,:][j]):
-                        monthstr = str(-999)
-                    else:
-                        monthstr = str( int( station_data[i,:][j]*1000 ) )
-                    rowstr += f"{monthstr:>5}"          
-                f.write(rowstr+'\n')                
-    f.close
+                # WRITE: station header + yearly rows of monthly values in CRUTEM format x1000
+
+                f.write( format_station( station_header, station_years, station_data ) )
+
+            if binary == True:
+                cube[group,k] = np.reshape( ts_ensemble, [ len( files ), t_end - t_start, 12 ] )
+
+        for f in files: f.close()
+
+    if binary == True:
+        cube.flush()
+        del cube
         
 # -----------------------------------------------------------------------------
 if __name__ == "__main__":
     
     parser = OptionParser("usage: %prog [options] member")
+    parser.add_option("-a", "--all", action="store_true", dest="all", default=False, help="write all ensemble members in a single pass")
+    parser.add_option("-b", "--binary", action="store_true", dest="binary", default=False, help="also write a memory-mappable .npy (member, station, year, month) cube with a station metadata sidecar")
+    parser.add_option("-n", "--nensemble", type="int", dest="nensemble", default=10, help="number of ensemble members ( equiprobable bins )")
+    parser.add_option("-l", "--large", action="store_true", dest="large", default=False, help="large-ensemble mode: all members to one binary cube, generated in memory-bounded batches ( no text files )")
+    parser.add_option("-s", "--statistics", action="store_true", dest="statistics", default=False, help="with --large: write only the ensemble mean, spread and percentiles")
+    parser.add_option("--seed", type="int", dest="seed", default=ensemble_seed, help="seed of the per-(member, station) random streams ( same seed --> identical members for any member subset or worker count )")
+    parser.add_option("-i", "--int16", action="store_true", dest="int16", default=False, help="with --large: store members as CRUTEM scaled int16 ( x1000 ) instead of float32")
     (options, args) = parser.parse_args()
-    if len(args) != 1:
-        parser.error("incorrect number of arguments: please enter ensemble member number")
-
-    member = int(args[0])
-    generate_ensemble(member)
+    if options.large:
+        generate_ensemble( nensemble=options.nensemble, large=True, statistics=options.statistics, dtype=np.int16 if options.int16 else np.float32, seed=options.seed )
+    elif options.all:
+        generate_ensemble( binary=options.binary, nensemble=options.nensemble, seed=options.seed )
+    else:
+        if len(args) != 1:
+            parser.error("incorrect number of arguments: please enter ensemble member number")
+        member = int(args[0])
+        generate_ensemble( [ member ], binary=options.binary, nensemble=options.nensemble, seed=options.seed )
     
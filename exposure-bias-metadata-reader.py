@@ -16,6 +16,8 @@
 import numpy as np
 import pandas as pd
 import pickle
+from exposure_bias_store import read_frame, write_frame
+from exposure_bias_breaks import sweep_breaks, variant_suffix
 from datetime import datetime
 # Plotting libraries:
 import matplotlib.pyplot as plt
@@ -29,6 +31,7 @@ import seaborn as sns; sns.set()
 fontsize = 16
 use_nma_assumption = False     # (default=False) True --> use all source_codes
 use_transition = True          # (default=True) False --> include transitions in categories
+use_sweep = True               # (default=True) True --> all use_nma_assumption / use_transition combinations in one run
 
 #------------------------------------------------------------------------------
 # LOAD: Emily's raw data
@@ -44,13 +47,13 @@ use_transition = True          # (default=True) False --> include transitions in
 #       'exposure_category', 'source_flag', 'exposurecorrected_flag'],
 #      dtype='object')
 
-metadatafile = 'DATA/df_exposure_bias.pkl'
-df_metadata = pd.read_pickle( metadatafile, compression='bz2' )
-
 #Index(['datetime', 'stationcode', 'exposure_category', 'bias', 'uncertainty', 'source_flag', 'exposurecorrected_flag'],
 #      dtype='object')
 
 columns = [ 'datetime', 'stationcode', 'exposure_category', 'source_flag', 'exposurecorrected_flag' ]
+
+metadatafile = 'DATA/df_exposure_bias.parquet'
+df_metadata = read_frame( metadatafile, columns=columns )
 df = pd.DataFrame(df_metadata, columns=columns)
     
 #------------------------------------------------------------------------------
@@ -66,97 +69,70 @@ n_exposurecorrected_flag = df.exposurecorrected_flag.unique().shape[0]
 n_exposurecorrected = df[df.exposurecorrected_flag==1].stationcode.unique().shape[0]    #  21
 
 #------------------------------------------------------------------------------
-# APPLY: filters
+# APPLY: filters + FIND: breaks for each flag variant ( one load, shared category encoding )
 #------------------------------------------------------------------------------
 
-if use_nma_assumption == False: df = df[ (df.source_flag < 3) ]
-if use_transition == False: df = df[ df.exposure_category.str.contains('Transition') == False ]
+if use_sweep == True:
+    variants = [ ( nma, transition ) for nma in [False, True] for transition in [False, True] ]
+else:
+    variants = [ ( use_nma_assumption, use_transition ) ]
 
-#------------------------------------------------------------------------------
-# FIND: breaks
-#------------------------------------------------------------------------------
+breaks = sweep_breaks( df, variants )
 
-# CREATE: dictionary mapping exposure_category keys to integer values
+for ( use_nma_assumption, use_transition ), dh in breaks.items():
 
-dg = df.copy().dropna(subset=['exposure_category','source_flag']).reset_index(drop=True)
-exposure_category_dict = dict( zip( dg.exposure_category.unique(), np.arange(n_exposure_category) ) )
+    variantstr = variant_suffix( use_nma_assumption, use_transition )
 
-# APPLY: dict map to dataframe
+    #==============================================================================
+    # PLOTS
+    #==============================================================================
 
-dg['exposure_category'] = dg['exposure_category'].map( exposure_category_dict )
+    # PLOT: breakpoints from exposure changes ( x=stationcode, y=breakpoint year )
 
-# FIND: break indices
-    
-v = dg['exposure_category']
-t = np.where( np.diff(v) )[0] + 1  
-
-# EXTRACT: breaks subset
-
-dh = dg.copy()
-mask = list( set( np.arange(len(dh)) ) - set(t) )
-dh = dh.drop( mask )
-
-#==============================================================================
-# PLOTS
-#==============================================================================
-
-# PLOT: breakpoints from exposure changes ( x=stationcode, y=breakpoint year )
-
-assumptionstr = ''
-transitionstr = ''
-if use_nma_assumption == True: assumptionstr = '_nma_assumption'
-if use_transition == True: transitionstr = '_transition'
-figstrstem = 'breakpoints_exposure_category_source_code_stationcode'
-figstr = figstrstem + assumptionstr + transitionstr + '.png'
-
-
-fig, ax = plt.subplots(figsize=(12, 7))
-for i in range( dh.source_flag.unique().shape[0] ):    
-    da = dh[ dh.source_flag == i+1 ]
-#    plt.plot(da.stationcode, da.datetime.dt.year, 'o', markersize=5, alpha=0.5, label='source_code='+str(i+1)+' : median='+str( int( np.median( da.datetime.dt.year ) ) ) )
-    plt.plot(da.datetime.dt.year, 'o', markersize=5, alpha=0.5, label='source_code='+str(i+1)+' : median='+str( int( np.median( da.datetime.dt.year ) ) ) )
-ax.axes.xaxis.set_ticklabels([])
-plt.legend(loc='lower right', fontsize=fontsize)
-plt.xlabel('stationcode', fontsize=fontsize)
-plt.ylabel('breakpoint year', fontsize=fontsize)
-plt.title( 'Breakpoints from changes in exposure_category', fontsize=fontsize )
-plt.savefig( figstr, dpi=300 )
-
-# PLOT: distribution of breakpoint years by source_code
-
-assumptionstr = ''
-transitionstr = ''
-if use_nma_assumption == True: assumptionstr = '_nma_assumption'
-if use_transition == True: transitionstr = '_transition'
-figstrstem = 'breakpoints_exposure_category_source_code_violinplot'
-figstr = figstrstem + assumptionstr + transitionstr + '.png'
-
-fig, ax = plt.subplots(figsize=(12, 7))
-for i in range( dh.source_flag.unique().shape[0] ):
-    da = dh[ dh.source_flag == i+1 ]
-    ax.violinplot(da.datetime.dt.year, positions = [i+1])
-ax.set_xlim(0.5, dh.source_flag.unique().shape[0] + 0.5)
-positions   = [1, 2, 3]
-labels = ['1','2','3']
-ax.set_xticks(positions)
-ax.set_xticklabels(labels)
-plt.xlabel('source_code', fontsize=fontsize)
-plt.ylabel('breakpoint year', fontsize=fontsize)
-plt.title( 'Breakpoints from changes in exposure_category', fontsize=fontsize )
-plt.savefig( figstr, dpi=300 )
-
-#==============================================================================
-# SAVE: breakpoints dataframe
-#==============================================================================
-
-assumptionstr = ''
-transitionstr = ''
-if use_nma_assumption == True: assumptionstr = '_nma_assumption'
-if use_transition == True: transitionstr = '_transition'
-pklstem = 'df_breaks'
-pklfile = pklstem + assumptionstr + transitionstr + '.pkl'
-
-dh.to_pickle( pklfile, compression='bz2')
+    figstrstem = 'breakpoints_exposure_category_source_code_stationcode'
+    figstr = figstrstem + variantstr + '.png'
+
+    fig, ax = plt.subplots(figsize=(12, 7))
+    for i in range( dh.source_flag.unique().shape[0] ):    
+        da = dh[ dh.source_flag == i+1 ]
+#        plt.plot(da.stationcode, da.datetime.dt.year, 'o', markersize=5, alpha=0.5, label='source_code='+str(i+1)+' : median='+str( int( np.median( da.datetime.dt.year ) ) ) )
+        plt.plot(da.datetime.dt.year, 'o', markersize=5, alpha=0.5, label='source_code='+str(i+1)+' : median='+str( int( np.median( da.datetime.dt.year ) ) ) )
+    ax.axes.xaxis.set_ticklabels([])
+    plt.legend(loc='lower right', fontsize=fontsize)
+    plt.xlabel('stationcode', fontsize=fontsize)
+    plt.ylabel('breakpoint year', fontsize=fontsize)
+    plt.title( 'Breakpoints from changes in exposure_category', fontsize=fontsize )
+    plt.savefig( figstr, dpi=300 )
+    plt.close(fig)
+
+    # PLOT: distribution of breakpoint years by source_code
+
+    figstrstem = 'breakpoints_exposure_category_source_code_violinplot'
+    figstr = figstrstem + variantstr + '.png'
+
+    fig, ax = plt.subplots(figsize=(12, 7))
+    for i in range( dh.source_flag.unique().shape[0] ):
+        da = dh[ dh.source_flag == i+1 ]
+        ax.violinplot(da.datetime.dt.year, positions = [i+1])
+    ax.set_xlim(0.5, dh.source_flag.unique().shape[0] + 0.5)
+    positions   = [1, 2, 3]
+    labels = ['1','2','3']
+    ax.set_xticks(positions)
+    ax.set_xticklabels(labels)
+    plt.xlabel('source_code', fontsize=fontsize)
+    plt.ylabel('breakpoint year', fontsize=fontsize)
+    plt.title( 'Breakpoints from changes in exposure_category', fontsize=fontsize )
+    plt.savefig( figstr, dpi=300 )
+    plt.close(fig)
+
+    #==============================================================================
+    # SAVE: breakpoints dataframe
+    #==============================================================================
+
+    pklstem = 'df_breaks'
+    pklfile = pklstem + variantstr + '.parquet'
+
+    write_frame( dh, pklfile )
 
 #------------------------------------------------------------------------------
 print('** END')
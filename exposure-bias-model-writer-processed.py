@@ -16,6 +16,11 @@
 import numpy as np
 import pandas as pd
 import pickle
+import os
+from exposure_bias_store import read_frame, write_frame
+from exposure_bias_manifest import file_hash, station_hashes, incremental_stations, station_blocks, write_manifest
+# CRUTEM format:
+from crutem_io import format_station, open_crutem, read_stat4_index, read_block
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
@@ -26,8 +31,9 @@ t_start = 1781
 t_end = 2021
 
 stat4file = 'CRUTEM/stat4.txt'
-exposure_bias_model_file = 'OUT/df_exposure_bias.pkl'
+exposure_bias_model_file = 'OUT/df_exposure_bias.parquet'
 exposure_bias_file = 'OUT/exposure_bias_model.txt'
+use_incremental = True         # (default=True) True --> recompute only stations whose model rows changed since the last write
 
 #------------------------------------------------------------------------------
 # METHODS
@@ -42,32 +48,33 @@ def make_timeseries( da ):
     return db
 
 #------------------------------------------------------------------------------
-# LOAD: exposure bias model .pkl file
+# LOAD: exposure bias model file
 #------------------------------------------------------------------------------
 
-df = pd.read_pickle( exposure_bias_model_file, compression='bz2' )
+df = read_frame( exposure_bias_model_file, columns=[ 'datetime', 'stationcode', 'bias' ] )
 stationcodes = df.stationcode.unique()
+station_rows = df.groupby( 'stationcode', sort=False, observed=True ).indices # stationcode --> row positions ( grouped once )
 
 #------------------------------------------------------------------------------
 # LOAD: CRUTEM5 stat4 file and extract headers and stationcodes
 #------------------------------------------------------------------------------
 
-headerlist = []
-stationcodelist = []
-    
-with open (stat4file, 'r', encoding="ISO-8859-1") as f:                      
-    for line in f:   
-        if len(line)>1: # ignore empty lines         
-            if (len(line.strip().split())!=13) | (len(line.split()[0])>4): # header lines
-                header = line
-                code = line[0:6]                                                                
-                headerlist.append( header )
-                stationcodelist.append( code )
-            else:           
-                continue                                     
-        else:                
-            continue
-f.close
+df_stat4 = read_stat4_index( stat4file ) # station index cached next to stat4file
+headerlist = list( df_stat4.header )
+stationcodelist = list( df_stat4.stationcode )
+header_rows = {}
+for i, code in enumerate( stationcodelist ): header_rows.setdefault( code, i ) # stationcode --> first header
+
+#------------------------------------------------------------------------------
+# INCREMENTAL: stations whose model rows changed since the last write ( None --> all )
+#------------------------------------------------------------------------------
+
+sources = {'stat4':file_hash( stat4file ), 'column':'bias', 't_start':t_start, 't_end':t_end}
+stations = station_hashes( df )
+changed = incremental_stations( exposure_bias_file, sources, stations ) if use_incremental == True else None
+df_blocks = station_blocks( exposure_bias_file, stationcodes ) if changed is not None else None # recorded in the manifest
+if df_blocks is None: changed = None
+else: changed = set( changed )
 
 #------------------------------------------------------------------------------
 # WRITE: exposure bias model estimates per station in CRUTEM format
@@ -77,14 +84,22 @@ exposure bias is in scaled integer format --> bias x1000
 fill values = -999
 '''   
 
-with open( exposure_bias_file, 'w' ) as f:
+with open_crutem( exposure_bias_file + '.tmp' ) as f, open( exposure_bias_file if changed is not None else os.devnull, 'rb' ) as f_previous:
     
+    offsets = [] # byte offset of each station block ( for the next incremental write )
     for k in range( len( stationcodes ) ):
+
+        offsets.append( f.tell() )
+
+        # COPY: unchanged station block from the previous write
+
+        if ( changed is not None ) and ( stationcodes[k] not in changed ):
+            f.write( read_block( f_previous, df_blocks.offset.iloc[k], df_blocks.length.iloc[k] ) )
+            continue
         
-        idx = [i for i in range(len(stationcodelist)) if stationcodelist[i] == stationcodes[k] ][0]
-        station_header = headerlist[ idx ]    
+        station_header = headerlist[ header_rows[ stationcodes[k] ] ]    
         
-        da = df[ df.stationcode == stationcodes[k] ].reset_index(drop=True)
+        da = df.iloc[ station_rows[ stationcodes[k] ] ].reset_index(drop=True)
         da.datetime = pd.date_range(start=str(da.datetime.loc[0].year), periods=len(da), freq='M')
         db = make_timeseries( da )        
         ts = db.bias.values
@@ -96,21 +111,15 @@ with open( exposure_bias_file, 'w' ) as f:
           
         # WRITE: station header + yearly rows of monthly values in CRUTEM format x1000
 
-        f.write(station_header)
-        for i in range(len(station_years)):  
-            rowstr = str(station_years[i])
-            for j in range(12):
-                if np.isnan(station_data[i,:][j]):
-                    monthstr = str(-999)
-                else:
-                    monthstr = str( int( station_data[i,:][j]*1000 ) )
-                rowstr += f"{monthstr:>5}"          
-            f.write(rowstr+'\n')
+        f.write( format_station( station_header, station_years, station_data ) )
 
         if k % 1000 == 0:
             print(k)
+
+    offsets.append( f.tell() )
    
-f.close
+os.replace( exposure_bias_file + '.tmp', exposure_bias_file )
+write_manifest( exposure_bias_file, sources, stations, ( stationcodes, offsets ) )
         
 #------------------------------------------------------------------------------
 print('** END')
@@ -16,6 +16,12 @@
 import numpy as np
 import pandas as pd
 import pickle
+import os
+from exposure_bias_store import read_frame, write_frame, frame_columns, locate_frame
+from exposure_bias_manifest import file_hash, station_hashes, incremental_stations, station_blocks, write_manifest
+from exposure_bias_engine import station_grids
+# CRUTEM format:
+from crutem_io import format_station, open_crutem, read_stat4_index, read_block, open_binary
 #------------------------------------------------------------------------------
 
 #------------------------------------------------------------------------------
@@ -26,99 +32,127 @@ t_start = 1781
 t_end = 2021
 
 stat4file = 'CRUTEM/stat4.txt'
-exposure_bias_model_file = 'OUT/df_exposure_bias.pkl'
-exposure_bias_file = 'OUT/exposure_bias_model.txt'
+exposure_bias_model_file = 'OUT/df_exposure_bias.parquet'
+use_incremental = True         # (default=True) True --> recompute only stations whose model rows changed since the last write
+use_binary = False            # (default=False) True --> also write each output as a memory-mappable (member, station, year, month) .npy cube + station sidecar
+
+# df_exposure_bias column --> CRUTEM format output file ( all columns present are written in one pass )
+
+output_files = {
+    'bias': 'OUT/exposure_bias_model.txt',
+    'uncertainty': 'OUT/exposure_bias_model_uncertainty.txt',
+    'bias_2.5': 'OUT/exposure_bias_model_2.5.txt',
+    'bias_97.5': 'OUT/exposure_bias_model_97.5.txt',
+}
 
 #------------------------------------------------------------------------------
-# METHODS
+# LOAD: exposure bias model file
 #------------------------------------------------------------------------------
 
-def make_timeseries( da ):
-      
-    t_full = pd.date_range(start=str( t_start ), end=str( t_end ), freq='M')
-    df_full = pd.DataFrame( {'datetime':t_full} )
-    db = df_full.merge( da, how='left', on='datetime' )
+# COLUMNS: outputs whose model column is present ( frames written before the 2.5 / 97.5 bounds were kept lack them )
+
+available = frame_columns( exposure_bias_model_file )
+columns = [ column for column in output_files if column in available ]
+if len( columns ) == 0:
+    raise ValueError( locate_frame( exposure_bias_model_file ) + ' has none of the model columns ' + ', '.join( output_files ) + ': rerun exposure-bias-model-reader.py' )
+for column in output_files:
+    if column not in columns:
+        print( 'skipping ' + output_files[ column ] + ': no ' + column + ' column in ' + locate_frame( exposure_bias_model_file ) )
+
+df = read_frame( exposure_bias_model_file, columns=[ 'datetime', 'stationcode' ] + columns )
 
-    return db
+# PIVOT: all columns to (station, year, month) grids on [t_start, t_end) in one grouped pass ( NaN where no model month )
+
+stationcodes, grids = station_grids( df, columns, t_start, t_end )
+station_index = dict( zip( stationcodes, range( len( stationcodes ) ) ) )
 
 #------------------------------------------------------------------------------
-# LOAD: exposure bias model .pkl file
+# LOAD: CRUTEM5 stat4 file and extract headers and stationcodes
 #------------------------------------------------------------------------------
 
-df = pd.read_pickle( exposure_bias_model_file, compression='bz2' )
-stationcodes = df.stationcode.unique()
+df_stat4 = read_stat4_index( stat4file ) # station index cached next to stat4file
+headerlist = list( df_stat4.header )
+stationcodelist = list( df_stat4.stationcode )
 
 #------------------------------------------------------------------------------
-# LOAD: CRUTEM5 stat4 file and extract headers and stationcodes
+# INCREMENTAL: per output, stations whose model rows changed since the last write ( None --> all )
 #------------------------------------------------------------------------------
 
-headerlist = []
-stationcodelist = []
-    
-with open (stat4file, 'r', encoding="ISO-8859-1") as f:                      
-    for line in f:   
-        if len(line)>1: # ignore empty lines         
-            if (len(line.strip().split())!=13) | (len(line.split()[0])>4): # header lines
-                header = line
-                code = line[0:6]                                                                
-                headerlist.append( header )
-                stationcodelist.append( code )
-            else:           
-                continue                                     
-        else:                
-            continue
-f.close
+stat4_hash = file_hash( stat4file )
+sources = {}
+stations = {}
+changed = {}
+blocks = {}
+for column in columns:
+    sources[ column ] = {'stat4':stat4_hash, 'column':column, 't_start':t_start, 't_end':t_end}
+    stations[ column ] = station_hashes( df, [ 'datetime', 'stationcode', column ] )
+    changed[ column ] = incremental_stations( output_files[ column ], sources[ column ], stations[ column ] ) if use_incremental == True else None
+    blocks[ column ] = station_blocks( output_files[ column ], stationcodelist ) if changed[ column ] is not None else None # recorded in the manifest
+    if blocks[ column ] is None: changed[ column ] = None
+    else: changed[ column ] = set( changed[ column ] )
 
 #------------------------------------------------------------------------------
 # WRITE: exposure bias model estimates per station in CRUTEM format
 #------------------------------------------------------------------------------
 '''
-exposure bias is in scaled integer format --> bias x1000
+exposure bias ( and uncertainty, 2.5 / 97.5 bounds ) is in scaled integer format --> value x1000
 fill values = -999
 '''   
 
-with open( exposure_bias_file, 'w' ) as f:
-    
-    for k in range( len( stationcodelist ) ):
+files = { column: open_crutem( output_files[ column ] + '.tmp' ) for column in columns }
+previous = { column: open( output_files[ column ], 'rb' ) for column in columns if changed[ column ] is not None }
+offsets = { column: [] for column in columns } # byte offset of each station block ( for the next incremental write )
+
+station_years = np.arange( t_start, t_end )    
+missing = np.full( ( len( station_years ), 12 ), np.nan )
+
+for k in range( len( stationcodelist ) ):
         
-        station_header = headerlist[k]
-        station_years = np.arange( t_start, t_end )    
-
-        idx = [i for i in range(len(stationcodes)) if stationcodes[i] == stationcodelist[k] ]
-        if len(idx) > 0:
-            da = df[ df.stationcode == stationcodes[idx[0]] ].reset_index(drop=True)
-            da.datetime = pd.date_range(start=str(da.datetime.loc[0].year), periods=len(da), freq='M')
-            db = make_timeseries( da )        
-            ts = db.bias.values
-        else:
-            ts = np.array( [np.nan]*(len(station_years)*12) ).ravel()
-    
+    station_header = headerlist[k]
+    i = station_index.get( stationcodelist[k] )
+
+    for column in columns:
+
+        offsets[ column ].append( files[ column ].tell() )
+
+        # COPY: unchanged station block from the previous write
+
+        if ( changed[ column ] is not None ) and ( stationcodelist[k] not in changed[ column ] ):
+            files[ column ].write( read_block( previous[ column ], blocks[ column ].offset.iloc[k], blocks[ column ].length.iloc[k] ) )
+            continue
+
         # EXTRACT: years and month data for CRUTEM format
-    
-        station_data = np.reshape( ts, [ len( station_years ), 12 ] )
+
+        station_data = grids[ column ][i] if i is not None else missing
           
         # WRITE: station header + yearly rows of monthly values in CRUTEM format x1000
 
-        f.write(station_header)
-        for i in range(len(station_years)):  
-            rowstr = str(station_years[i])
-            for j in range(12):
-                if np.isnan(station_data[i,:][j]):
-                    monthstr = str(-999)
-                else:
-                    monthstr = str( int( station_data[i,:][j]*1000 ) )
-                rowstr += f"{monthstr:>5}"          
-            f.write(rowstr+'\n')
-
-        if k % 1000 == 0:
-            print(k)
+        files[ column ].write( format_station( station_header, station_years, station_data ) )
+
+    if k % 1000 == 0:
+        print(k)
    
-f.close
-        
+for column in columns: offsets[ column ].append( files[ column ].tell() )
+for f in list( files.values() ) + list( previous.values() ): f.close()
+
+for column in columns:
+    os.replace( output_files[ column ] + '.tmp', output_files[ column ] )
+    write_manifest( output_files[ column ], sources[ column ], stations[ column ], ( stationcodelist, offsets[ column ] ) )
+
+#------------------------------------------------------------------------------
+# WRITE: binary cubes in stat4 station order ( single member, full precision, NaN fill )
 #------------------------------------------------------------------------------
-print('** END')
 
+if use_binary == True:
 
+    model_index = np.array( [ station_index.get( code, -1 ) for code in stationcodelist ], dtype=np.int64 )
+    in_model = ( model_index >= 0 )[:,np.newaxis,np.newaxis]
 
+    for column in columns:
+        cube = open_binary( os.path.splitext( output_files[ column ] )[0], df_stat4, [ 1 ], t_start, t_end, column )
+        cube[0] = np.where( in_model, grids[ column ][ np.clip( model_index, 0, None ) ], np.nan )
+        cube.flush()
+        del cube
 
-    
+#------------------------------------------------------------------------------
+print('** END')
@@ -0,0 +1,69 @@
+#------------------------------------------------------------------------------
+# PROGRAM: exposure-bias-pipeline.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+from optparse import OptionParser
+from exposure_bias_pipeline import run_pipeline
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# SETTINGS: stages of the exposure bias workflow
+#------------------------------------------------------------------------------
+
+modelfiles = 'DATA/GloSATP04_Extratropics_ExposureBias_v0.4_Part*_GloSAT_22.06.22.csv'
+
+stages = {
+    'model-reader': {
+        'script': 'exposure-bias-model-reader.py',
+        'inputs': { modelfiles: 'csv' },
+        'outputs': { 'df_exposure_bias.parquet': 'frame' },
+        'publish': { 'df_exposure_bias.parquet': [ 'DATA/df_exposure_bias.parquet', 'OUT/df_exposure_bias.parquet' ] },
+    },
+    'metadata-reader': {
+        'script': 'exposure-bias-metadata-reader.py',
+        'inputs': { 'DATA/df_exposure_bias.parquet': 'frame' },
+        'outputs': { 'df_breaks*.parquet': 'frame' },
+    },
+    'model-writer': {
+        'script': 'exposure-bias-model-writer.py', # bias, uncertainty and 2.5 / 97.5 bounds in one pass
+        'inputs': { 'OUT/df_exposure_bias.parquet': 'frame', 'CRUTEM/stat4.txt': 'stat4' },
+        'outputs': { 'OUT/exposure_bias_model.txt': 'crutem', 'OUT/exposure_bias_model_uncertainty.txt': 'crutem', 'OUT/exposure_bias_model_2.5.txt': 'crutem', 'OUT/exposure_bias_model_97.5.txt': 'crutem' },
+    },
+    'correction': {
+        'script': 'exposure-bias-correction.py',
+        'inputs': { 'DATA/df_temp_qc.parquet': 'frame', 'DATA/df_exposure_bias.parquet': 'frame' },
+        'outputs': { 'df_temp_ebc.parquet': 'frame', 'df_ebc.parquet': 'frame', 'global-mean-ebc-monthly.png': 'png' },
+        'publish': { 'df_temp_ebc.parquet': [ 'OUT/df_temp_ebc.parquet' ], 'df_ebc.parquet': [ 'OUT/df_ebc.parquet' ] },
+    },
+    'plots': {
+        'script': 'plot-exposure-bias-correction.py',
+        'inputs': { 'DATA/df_temp_qc.parquet': 'frame', 'OUT/df_temp_ebc.parquet': 'frame', 'OUT/df_ebc.parquet': 'frame' },
+        'outputs': { 'hemispherical-mean-temp.png': 'png', 'hemispherical-mean-ebc.png': 'png' },
+    },
+    'plots-area-weighted': {
+        'script': 'plot-exposure-bias-correction-area-weighted.py',
+        'inputs': { 'OUT/df_ebc.parquet': 'frame', 'DATA/sftof.nc': 'netcdf' },
+        'outputs': { 'zonal-mean-ebc-*.png': 'png' },
+    },
+}
+
+#------------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    parser = OptionParser("usage: %prog [options] [stage ...]")
+    parser.add_option("-f", "--force", action="store_true", dest="force", default=False, help="run stages even if their inputs are unchanged")
+    parser.add_option("-s", "--single-process", action="store_true", dest="single_process", default=False, help="run stages in this process, keeping loaded dataframes in memory across stages")
+    parser.add_option("-j", "--jobs", type="int", dest="njobs", default=None, help="maximum number of stages run concurrently")
+    (options, args) = parser.parse_args()
+
+    status = run_pipeline( stages, targets=args if len(args) > 0 else None, force=options.force, single_process=options.single_process, njobs=options.njobs )
+    for name in status:
+        print( name, status[ name ] )
+
+#------------------------------------------------------------------------------
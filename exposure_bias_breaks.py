@@ -0,0 +1,115 @@
+#------------------------------------------------------------------------------
+# MODULE: exposure_bias_breaks.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+# Dataframe libraries:
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# METHODS
+#------------------------------------------------------------------------------
+
+def station_order( df ):
+
+    '''
+    Row order by (stationcode, datetime). Returns None if the rows are
+    already in that order ( the usual case ) so no sort is needed.
+    '''
+
+    station_idx = pd.factorize( df.stationcode )[0] # first appearance order
+    datetimes = df.datetime.values
+
+    contiguous = np.all( station_idx[1:] >= station_idx[:-1] )
+    same_station = station_idx[1:] == station_idx[:-1]
+    increasing = np.all( datetimes[1:][ same_station ] >= datetimes[:-1][ same_station ] )
+
+    if contiguous & increasing: return None
+    return np.lexsort( ( datetimes, station_idx ) )
+
+def find_breaks( df, column='exposure_category' ):
+
+    '''
+    Breakpoints: rows where column changes value from the previous month of
+    the same station. One vectorised pass over rows in (stationcode,
+    datetime) order; the first row of each station is never a break.
+
+    Returns: dataframe of break rows
+    '''
+
+    order = station_order( df )
+    if order is not None: df = df.iloc[ order ]
+
+    station_idx = pd.factorize( df.stationcode )[0]
+    values = np.asarray( df[ column ] )
+
+    is_break = np.zeros( len(df), dtype=bool )
+    is_break[1:] = ( values[1:] != values[:-1] ) & ( station_idx[1:] == station_idx[:-1] )
+
+    return df[ is_break ]
+
+def variant_suffix( use_nma_assumption, use_transition ):
+
+    assumptionstr = ''
+    transitionstr = ''
+    if use_nma_assumption == True: assumptionstr = '_nma_assumption'
+    if use_transition == True: transitionstr = '_transition'
+    return assumptionstr + transitionstr
+
+def encode_categories( df ):
+
+    '''
+    Integer encoding of exposure_category ( order of first appearance ) shared
+    by all filter variants.
+    '''
+
+    dg = df.dropna(subset=['exposure_category','source_flag'])
+    categories = dg.exposure_category.unique()
+    return dict( zip( categories, np.arange( len( categories ) ) ) )
+
+def sweep_breaks( df, variants, nworkers=None ):
+
+    '''
+    Breakpoints for each (use_nma_assumption, use_transition) variant from a
+    single load: the category encoding and the row filters are computed
+    once and the independent variants run in parallel.
+
+    use_nma_assumption: False --> source_flag < 3 only
+    use_transition: False --> exclude 'Transition' exposure categories
+
+    Returns: dict (use_nma_assumption, use_transition) --> breaks dataframe
+    '''
+
+    encoding = encode_categories( df )
+
+    valid = ( df.exposure_category.notna() & df.source_flag.notna() ).values
+    is_station_metadata = ( df.source_flag < 3 ).values
+    is_transition = df.exposure_category.astype(object).str.contains('Transition', na=False).values
+
+    def extract_breaks( variant ):
+
+        use_nma_assumption, use_transition = variant
+
+        mask = valid.copy()
+        if use_nma_assumption == False: mask &= is_station_metadata
+        if use_transition == False: mask &= ~is_transition
+
+        dg = df[ mask ].reset_index(drop=True)
+        dg['exposure_category'] = dg['exposure_category'].map( encoding ).astype(int)
+
+        return find_breaks( dg )
+
+    with ThreadPoolExecutor( max_workers=nworkers ) as pool:
+        breaks = list( pool.map( extract_breaks, variants ) )
+
+    return dict( zip( variants, breaks ) )
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,179 @@
+#------------------------------------------------------------------------------
+# MODULE: exposure_bias_cube.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+# Dataframe libraries:
+import numpy as np
+import pandas as pd
+from exposure_bias_engine import months
+from exposure_bias_store import read_frame, iter_frame, locate_frame
+from exposure_bias_manifest import file_hash
+# OS libraries:
+import os
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# SETTINGS:
+#------------------------------------------------------------------------------
+
+cube_version = 1                # bump to invalidate cached cubes when the layout changes
+cache_dir = 'CACHE'             # memoized cubes: CACHE/cube_<input sha256>.npz
+
+# regions: name --> station mask ( stations with NaN latitude are in GL only )
+
+regions = {
+    'NH': lambda df: ( df.stationlat >= 0 ).values,
+    'SH': lambda df: ( df.stationlat < 0 ).values,
+    'GL': lambda df: np.ones( len(df), dtype=bool ),
+}
+
+#------------------------------------------------------------------------------
+# METHODS
+#------------------------------------------------------------------------------
+
+def build_cube( df ):
+
+    '''
+    Aggregation cube of a station-year table ( columns year, '1'..'12',
+    stationlat ): per (region, year, month) sum and count of valid values,
+    plus the number of station rows per (region, year). One bincount per
+    region over the flattened (year, month) index.
+    '''
+
+    years = df.year.values.astype( np.int64 )
+    year0 = years.min() if len( years ) > 0 else 0
+    nyears = years.max() - year0 + 1 if len( years ) > 0 else 0
+
+    values = df[ months ].values.astype( float )
+    valid = ~np.isnan( values )
+    flat_idx = ( ( years - year0 )[:,np.newaxis] * 12 + np.arange(12) )
+
+    sums = np.zeros( ( len( regions ), nyears, 12 ) )
+    counts = np.zeros( ( len( regions ), nyears, 12 ), dtype=np.int64 )
+    nrows = np.zeros( ( len( regions ), nyears ), dtype=np.int64 )
+
+    for r, name in enumerate( regions ):
+        mask = regions[ name ]( df )
+        idx = flat_idx[ mask ].ravel()
+        sums[r] = np.bincount( idx, weights=np.where( valid, values, 0.0 )[ mask ].ravel(), minlength=nyears*12 ).reshape( nyears, 12 )
+        counts[r] = np.bincount( idx, weights=valid[ mask ].ravel(), minlength=nyears*12 ).reshape( nyears, 12 ).astype( np.int64 )
+        nrows[r] = np.bincount( years[ mask ] - year0, minlength=nyears )
+
+    return {'regions':np.array( list( regions ) ), 'year0':year0, 'sums':sums, 'counts':counts, 'nrows':nrows}
+
+def merge_cubes( cubes ):
+
+    '''
+    Cube of the union of disjoint sets of rows ( e.g. the chunks of a
+    streamed frame ): the sums, counts and station rows added over the
+    union of their years.
+    '''
+
+    cubes = list( cubes )
+    spans = [ ( int( cube['year0'] ), int( cube['year0'] ) + cube['nrows'].shape[1] ) for cube in cubes if cube['nrows'].shape[1] > 0 ]
+    year0 = min( span[0] for span in spans ) if len( spans ) > 0 else 0
+    nyears = max( span[1] for span in spans ) - year0 if len( spans ) > 0 else 0
+
+    sums = np.zeros( ( len( regions ), nyears, 12 ) )
+    counts = np.zeros( ( len( regions ), nyears, 12 ), dtype=np.int64 )
+    nrows = np.zeros( ( len( regions ), nyears ), dtype=np.int64 )
+
+    for cube in cubes:
+        start = int( cube['year0'] ) - year0
+        stop = start + cube['nrows'].shape[1]
+        sums[:,start:stop] += cube['sums']
+        counts[:,start:stop] += cube['counts']
+        nrows[:,start:stop] += cube['nrows']
+
+    return {'regions':np.array( list( regions ) ), 'year0':year0, 'sums':sums, 'counts':counts, 'nrows':nrows}
+
+def accumulate_cubes( chunks, position, cubes ):
+
+    '''
+    Pass streamed tuples of frames through unchanged, appending the cube of
+    frame [position] of each tuple to cubes ( merge_cubes them afterwards ).
+    '''
+
+    for frames in chunks:
+        cubes.append( build_cube( frames[ position ] ) )
+        yield frames
+
+def cube_file( path ):
+
+    return os.path.join( cache_dir, 'cube_v' + str( cube_version ) + '_' + file_hash( path ) + '.npz' )
+
+def save_cube( path, cube ):
+
+    '''
+    Memoize a cube built elsewhere ( e.g. while streaming the file out ) as
+    the cube of a dataframe file, so load_cube finds it.
+    '''
+
+    try:
+        os.makedirs( cache_dir, exist_ok=True )
+        np.savez( cube_file( os.path.realpath( locate_frame( path ) ) ), **cube )
+    except OSError:
+        pass # read-only location --> cube is rebuilt on the next run
+
+def load_cube( path, chunk_rows=None ):
+
+    '''
+    Aggregation cube of a dataframe file, memoized to disk keyed by the
+    sha256 of the file contents: a cache hit skips loading the dataframe.
+
+    chunk_rows: on a cache miss build the cube chunk by chunk ( None --> whole frame )
+    '''
+
+    path = os.path.realpath( locate_frame( path ) )
+    cachefile = cube_file( path )
+
+    if os.path.exists( cachefile ):
+        try:
+            with np.load( cachefile ) as f:
+                return {key:f[key] for key in f.files}
+        except ( OSError, ValueError, KeyError ):
+            pass
+
+    columns = [ 'year' ] + months + [ 'stationlat' ]
+    if chunk_rows is None:
+        cube = build_cube( read_frame( path, columns=columns ) )
+    else:
+        cube = merge_cubes( build_cube( df ) for df in iter_frame( path, chunk_rows, columns=columns ) )
+
+    try:
+        os.makedirs( cache_dir, exist_ok=True )
+        np.savez( cachefile, **cube )
+    except OSError:
+        pass # read-only location --> cube is rebuilt on the next run
+
+    return cube
+
+def cube_means( cube, region, years=None ):
+
+    '''
+    Slice the cube: (year, month) means of a region as a dataframe indexed
+    by year with columns '1'..'12' ( equivalent to
+    df[region].groupby('year').mean().iloc[:,0:12] ).
+
+    years: (first, last) inclusive year range ( None --> all )
+    '''
+
+    r = list( cube['regions'] ).index( region )
+    year_index = int( cube['year0'] ) + np.arange( cube['nrows'].shape[1] )
+
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        means = cube['sums'][r] / cube['counts'][r]
+    means[ cube['counts'][r] == 0 ] = np.nan
+
+    keep = cube['nrows'][r] > 0
+    if years is not None: keep &= ( year_index >= years[0] ) & ( year_index <= years[1] )
+
+    return pd.DataFrame( means[ keep ], index=pd.Index( year_index[ keep ], name='year' ), columns=months )
+
+#------------------------------------------------------------------------------
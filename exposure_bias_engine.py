@@ -0,0 +1,301 @@
+#------------------------------------------------------------------------------
+# MODULE: exposure_bias_engine.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+# Dataframe libraries:
+import numpy as np
+import pandas as pd
+# OS libraries:
+import os
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+#------------------------------------------------------------------------------
+
+months = [ str(i) for i in range(1,13) ]
+shards_per_worker = 4           # station shards per worker process ( load balancing )
+
+shared_pivot = {}               # worker process view of the pivoted model in shared memory
+
+#------------------------------------------------------------------------------
+# METHODS
+#------------------------------------------------------------------------------
+
+def pivot_positions( df_ebm ):
+
+    '''
+    (station, year, month) position of every row of the long-format exposure
+    bias model. As in the per-station loop, the datetimes of each station are
+    re-stamped as a contiguous monthly series starting in January of the
+    first year of the station record.
+
+    Returns: stationcodes (sorted), station_idx, years, month_idx
+    '''
+
+    station_idx, stationcodes = pd.factorize( df_ebm.stationcode, sort=True ) # str or categorical stationcodes
+    stationcodes = np.asarray( stationcodes, dtype=object )
+    position = pd.Series( station_idx ).groupby( station_idx, sort=False ).cumcount().values
+    first_year = pd.Series( df_ebm.datetime.dt.year.values ).groupby( station_idx, sort=False ).transform('first').values
+
+    return stationcodes, station_idx, first_year + position // 12, position % 12
+
+def pivot_exposure_bias( df_ebm, column='bias' ):
+
+    '''
+    Pivot the long-format exposure bias model ( one row per station-month )
+    to a dense (station, year, month) array.
+
+    Returns: stationcodes (sorted), year0, values[station,year,month], covered[station,year]
+    '''
+
+    stationcodes, station_idx, years, month_idx = pivot_positions( df_ebm )
+
+    year0 = years.min()
+    year_idx = years - year0
+    nyears = year_idx.max() + 1
+
+    values = np.zeros( ( len(stationcodes), nyears, 12 ) )
+    covered = np.zeros( ( len(stationcodes), nyears ), dtype=bool )
+    values[ station_idx, year_idx, month_idx ] = df_ebm[ column ].values
+    covered[ station_idx, year_idx ] = True
+
+    return stationcodes, year0, values, covered
+
+def station_grids( df_ebm, columns, t_start, t_end ):
+
+    '''
+    Any set of model columns on the fixed (station, year, month) grid of
+    years [t_start, t_end) in one pass: NaN where a station has no model
+    month ( the per-station make_timeseries merge ).
+
+    Returns: stationcodes (sorted), {column: values[station,year,month]}
+    '''
+
+    stationcodes, station_idx, years, month_idx = pivot_positions( df_ebm )
+
+    inside = ( years >= t_start ) & ( years < t_end )
+    station_idx, year_idx, month_idx = station_idx[ inside ], years[ inside ] - t_start, month_idx[ inside ]
+
+    grids = {}
+    for column in columns:
+        values = np.full( ( len(stationcodes), t_end - t_start, 12 ), np.nan )
+        values[ station_idx, year_idx, month_idx ] = df_ebm[ column ].values[ inside ]
+        grids[ column ] = values
+
+    return stationcodes, grids
+
+def align_exposure_bias( df_temp, stationcodes, year0, values, covered ):
+
+    '''
+    Align the (station, year, month) array with the rows of a wide-format
+    temperature dataframe ( one row per station-year, columns '1'..'12' ).
+
+    Returns: mask of rows with a model estimate, bias[row,month] for those rows
+    '''
+
+    station_idx = pd.Index( stationcodes ).get_indexer( np.asarray( df_temp.stationcode, dtype=object ) )
+    year_idx = df_temp.year.values.astype(int) - year0
+
+    mask = ( station_idx >= 0 ) & ( year_idx >= 0 ) & ( year_idx < values.shape[1] )
+    mask[ mask ] = covered[ station_idx[mask], year_idx[mask] ]
+
+    return mask, values[ station_idx[mask], year_idx[mask], : ]
+
+def corrected_frames( df_temp, mask, bias ):
+
+    '''
+    Add aligned bias rows to the masked rows of a temperature dataframe.
+
+    Returns: df_temp_ebc ( bias corrected temperatures ), df_ebc ( corrections )
+    '''
+
+    df_temp_ebc = df_temp.copy()
+    df_ebc = df_temp.copy()
+    for i in range(12):
+
+        month = months[i]
+
+        temp = df_temp_ebc[ month ].values.copy()
+        temp[ mask ] = temp[ mask ] + bias[ :, i ]
+        df_temp_ebc[ month ] = temp
+
+        ebc = np.zeros( len( df_ebc ) )
+        ebc[ mask ] = ebc[ mask ] + bias[ :, i ]
+        df_ebc[ month ] = ebc
+
+    return df_temp_ebc, df_ebc
+
+def correct_frame( df_temp, pivot ):
+
+    '''
+    Bias correct a temperature dataframe ( or any chunk of its rows ) with
+    a pivoted exposure bias model from pivot_exposure_bias.
+
+    Returns: df_temp_ebc ( bias corrected temperatures ), df_ebc ( corrections )
+    '''
+
+    mask, bias = align_exposure_bias( df_temp, *pivot )
+    return corrected_frames( df_temp, mask, bias )
+
+def apply_exposure_bias( df_temp, df_ebm ):
+
+    '''
+    Add the exposure bias model to every matching station-year of the
+    temperature dataframe in one aligned pass. Rows are matched to the
+    model by ( stationcode, year ), not by position as in the original
+    per-station loop: the results agree when each station's rows are in
+    year order and its model months cover exactly those years, and differ
+    from the loop on year-shuffled input ( rows outside the model years
+    are left uncorrected ).
+
+    Returns: df_temp_ebc ( bias corrected temperatures ), df_ebc ( corrections )
+    '''
+
+    return correct_frame( df_temp, pivot_exposure_bias( df_ebm ) )
+
+def correct_stations( df_temp, df_ebm, stationcodes ):
+
+    '''
+    Recorrect the temperature rows of the given stations against their
+    model rows ( no model rows left --> no correction ).
+
+    Returns: df_temp_ebc ( bias corrected temperatures ), df_ebc ( corrections )
+    '''
+
+    df_ebm = df_ebm[ df_ebm.stationcode.isin( stationcodes ).values ]
+    if len( df_ebm ) > 0:
+        return apply_exposure_bias( df_temp, df_ebm )
+    return df_temp, df_temp.assign( **{ month:0.0 for month in months } )
+
+def patch_exposure_bias( df_temp_ebc, df_ebc, df_temp, df_ebm, stationcodes ):
+
+    '''
+    Incremental correction: recompute only the rows of the given stations
+    and patch them into existing outputs in place.
+
+    df_temp: temperature rows of those stations ( in output row order )
+    df_ebm: exposure bias model ( any stations )
+    '''
+
+    rows = df_temp_ebc.stationcode.isin( stationcodes ).values
+    if rows.sum() != len( df_temp ):
+        raise ValueError( 'temperature rows of the changed stations do not match the existing outputs' )
+
+    temp_ebc, ebc = correct_stations( df_temp, df_ebm, stationcodes )
+
+    df_temp_ebc.loc[ rows, months ] = temp_ebc[ months ].values
+    df_ebc.loc[ rows, months ] = ebc[ months ].values
+
+def patch_chunks( chunks, stationcodes, patch ):
+
+    '''
+    Streaming incremental correction: pass the chunks of an existing output
+    through with the rows of the given stations replaced, in order, by the
+    rows of patch ( from correct_stations ), so only the changed stations
+    are held in memory.
+
+    Yields: (chunk,) per chunk ( for write_frame_chunks )
+    '''
+
+    values = patch[ months ].values
+    start = 0
+    for df in chunks:
+        rows = df.stationcode.isin( stationcodes ).values
+        nrows = rows.sum()
+        if start + nrows > len( values ):
+            raise ValueError( 'temperature rows of the changed stations do not match the existing outputs' )
+        df.loc[ rows, months ] = values[ start:start+nrows ]
+        start += nrows
+        yield ( df, )
+
+    if start != len( values ):
+        raise ValueError( 'temperature rows of the changed stations do not match the existing outputs' )
+
+def stream_exposure_bias( temp_chunks, df_ebm ):
+
+    '''
+    Streaming correction: pivot the model once and correct each chunk of
+    temperature rows as it arrives ( rows are independent, so chunks need
+    not align with stations ).
+
+    Yields: (df_temp_ebc, df_ebc) per chunk
+    '''
+
+    pivot = pivot_exposure_bias( df_ebm )
+    for df_temp in temp_chunks:
+        yield correct_frame( df_temp, pivot )
+
+#
+
+def attach_pivot( stationcodes, year0, specs ):
+
+    '''
+    Worker initializer: map the pivoted model arrays from shared memory
+    ( read-only, no copy ).
+    '''
+
+    shared_pivot['blocks'] = [ shared_memory.SharedMemory( name=name ) for name, shape, dtype in specs ]
+    arrays = [ np.ndarray( shape, dtype=dtype, buffer=block.buf ) for block, ( name, shape, dtype ) in zip( shared_pivot['blocks'], specs ) ]
+    for array in arrays: array.flags.writeable = False
+    shared_pivot['pivot'] = ( stationcodes, year0 ) + tuple( arrays )
+
+def correct_shard( df_temp ):
+
+    return correct_frame( df_temp, shared_pivot['pivot'] )
+
+def parallel_exposure_bias( df_temp, df_ebm, nworkers=None, mp_context=None ):
+
+    '''
+    Process-pool correction: stations are sharded across worker processes
+    that correct their rows against the pivoted model held once in shared
+    memory. Corrected shards are put back in row order, so the output is
+    identical to apply_exposure_bias. Scripts calling this must guard their
+    body with if __name__ == "__main__": ( spawn workers import the script ).
+
+    mp_context: multiprocessing context of the pool ( None --> platform default )
+    Returns: df_temp_ebc ( bias corrected temperatures ), df_ebc ( corrections )
+    '''
+
+    stationcodes, year0, values, covered = pivot_exposure_bias( df_ebm )
+
+    blocks = []
+    try:
+        specs = []
+        for array in [ values, covered ]:
+            block = shared_memory.SharedMemory( create=True, size=max( array.nbytes, 1 ) )
+            blocks.append( block )
+            np.ndarray( array.shape, dtype=array.dtype, buffer=block.buf )[...] = array
+            specs.append( ( block.name, array.shape, array.dtype.str ) )
+
+        # SHARD: rows by station ( contiguous blocks of sorted stationcodes )
+
+        station_idx, temp_stationcodes = pd.factorize( df_temp.stationcode, sort=True )
+        nworkers = nworkers or os.cpu_count()
+        nshards = max( min( nworkers * shards_per_worker, len( temp_stationcodes ) ), 1 )
+        shard_idx = station_idx * nshards // max( len( temp_stationcodes ), 1 )
+        order = np.argsort( shard_idx, kind='stable' )
+        shard_rows = np.split( order, np.searchsorted( shard_idx[ order ], np.arange( 1, nshards ) ) )
+
+        shards = ( df_temp.iloc[ rows ] for rows in shard_rows )
+
+        with ProcessPoolExecutor( max_workers=nworkers, mp_context=mp_context, initializer=attach_pivot, initargs=( stationcodes, year0, specs ) ) as pool:
+            results = list( pool.map( correct_shard, shards ) )
+    finally:
+        for block in blocks:
+            block.close()
+            block.unlink()
+
+    # MERGE: corrected shards back to the input row order
+
+    inverse = np.argsort( np.concatenate( shard_rows ), kind='stable' )
+    df_temp_ebc = pd.concat( [ result[0] for result in results ] ).iloc[ inverse ]
+    df_ebc = pd.concat( [ result[1] for result in results ] ).iloc[ inverse ]
+
+    return df_temp_ebc, df_ebc
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,274 @@
+#------------------------------------------------------------------------------
+# MODULE: exposure_bias_ensemble.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+# Dataframe libraries:
+import numpy as np
+import hashlib
+from functools import lru_cache
+# Maths libraries
+from scipy.special import ndtr, ndtri
+# CRUTEM format:
+from crutem_io import open_binary, scale_factor
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# SETTINGS:
+#------------------------------------------------------------------------------
+
+batch_bytes = 256 * 1024 * 1024 # working memory per batch of members in large-ensemble mode
+draw_bytes = 128                # working memory per (member, station) draw ( Philox words and temporaries )
+percentiles = [ 2.5, 50, 97.5 ] # ensemble percentiles reported in statistics mode
+ensemble_seed = 20220503        # default seed of the counter-based ensemble streams
+philox_multipliers = ( 0xD2511F53, 0xCD9E8D57 ) # Philox4x32 round multipliers
+philox_weyl = ( 0x9E3779B9, 0xBB67AE85 ) # Philox4x32 key schedule increments
+
+# latitude regimes of the HadCRUT5 exposure bias model: (taper_start, taper_end, uncertainty)
+
+regimes = [
+    ( 1930, 1950, 0.2 ),        # extratropics: |lat| > 20
+    ( 1900, 1930, 0.1 ),        # tropics
+]
+
+#------------------------------------------------------------------------------
+# METHODS
+#------------------------------------------------------------------------------
+
+def bin_quantiles( u, nensemble, members=None ):
+
+    '''
+    Standard normal draws from equiprobable bins: uniforms u (..., members)
+    mapped by inverse-CDF onto the truncated normal of each member's bin
+    ( the nensemble equal-width bins spanning [-1,+1] ).
+    '''
+
+    if members is None: members = np.arange( nensemble )
+
+    z_edges = np.linspace( -1, 1, nensemble+1 )
+    p_lower = ndtr( z_edges[:-1] )[ members ]
+    p_upper = ndtr( z_edges[1:] )[ members ]
+
+    return ndtri( p_lower + u * ( p_upper - p_lower ) )
+
+def sample_equiprobable_bins( uncertainty, nensemble, rng=None ):
+
+    '''
+    Draw one realisation of N(0,uncertainty) from each of the nensemble
+    equal-width bins spanning [-uncertainty,+uncertainty] by inverse-CDF
+    sampling of the truncated normal on each bin interval.
+
+    uncertainty: scalar or array of any shape ( e.g. one value per station )
+    Returns: array of shape uncertainty.shape + (nensemble,) ( member last )
+    '''
+
+    if rng is None: rng = np.random.default_rng()
+
+    uncertainty = np.asarray( uncertainty, dtype=float )
+
+    # bin edges in units of the standard deviation are the same for every uncertainty
+
+    u = rng.uniform( size = uncertainty.shape + (nensemble,) )
+
+    return uncertainty[...,np.newaxis] * bin_quantiles( u, nensemble )
+
+def philox4x32( counter, key, rounds=10 ):
+
+    '''
+    Philox4x32-10 counter-based generator ( Salmon et al. [2011] ),
+    vectorised over counters: every counter maps to 4 independent random
+    32-bit words with no generator state.
+
+    counter: 4 arrays of 32-bit words ( broadcast together )
+    key: 2 32-bit words
+    Returns: 4 uint64 arrays of 32-bit words
+    '''
+
+    mask = np.uint64( 0xFFFFFFFF )
+    c0, c1, c2, c3 = np.broadcast_arrays( *[ np.asarray( word, dtype=np.uint64 ) & mask for word in counter ] )
+    k0, k1 = int( key[0] ), int( key[1] )
+
+    for r in range( rounds ):
+        p0 = c0 * np.uint64( philox_multipliers[0] )
+        p1 = c2 * np.uint64( philox_multipliers[1] )
+        c0, c1, c2, c3 = ( p1 >> np.uint64(32) ) ^ c1 ^ np.uint64( k0 ), p1 & mask, ( p0 >> np.uint64(32) ) ^ c3 ^ np.uint64( k1 ), p0 & mask
+        k0 = ( k0 + philox_weyl[0] ) & 0xFFFFFFFF
+        k1 = ( k1 + philox_weyl[1] ) & 0xFFFFFFFF
+
+    return c0, c1, c2, c3
+
+def stream_uniforms( seed, identities, members ):
+
+    '''
+    One uniform in [0,1) per (identity, member) from independent
+    counter-based streams: the Philox key comes from np.random.SeedSequence
+    ( seed ) and the counter is ( member, 64-bit hash of the identity, 0 ).
+    Each value depends only on its own seed, identity and member, so any
+    subset regenerates identically in any order on any number of workers.
+
+    identities: station codes ( or regime names ) labelling the streams
+    Returns: array (identities, members)
+    '''
+
+    key = np.random.SeedSequence( seed ).generate_state( 2, np.uint32 )
+    ids = np.array( [ int.from_bytes( hashlib.blake2b( str( identity ).encode(), digest_size=8 ).digest(), 'little' ) for identity in identities ], dtype=np.uint64 )
+    members = np.asarray( members, dtype=np.uint64 )
+
+    words = philox4x32( ( members[np.newaxis,:], ( ids & np.uint64( 0xFFFFFFFF ) )[:,np.newaxis], ( ids >> np.uint64(32) )[:,np.newaxis], 0 ), key )
+
+    # 53-bit double from the first two words
+
+    return ( ( words[0] >> np.uint64(5) ) * 67108864.0 + ( words[1] >> np.uint64(6) ) ) / 9007199254740992.0
+
+def stream_equiprobable_bins( uncertainty, nensemble, identities, members=None, seed=ensemble_seed ):
+
+    '''
+    Reproducible sample_equiprobable_bins: the draw of each (identity,
+    member) comes from its own counter-based stream ( stream_uniforms ).
+
+    uncertainty: scalar or one value per identity
+    members: members ( 0-based ) to draw ( None --> all nensemble )
+    Returns: array (identities, members)
+    '''
+
+    if members is None: members = np.arange( nensemble )
+    members = np.asarray( members )
+
+    u = stream_uniforms( seed, identities, members )
+    uncertainty = np.asarray( uncertainty, dtype=float ).reshape( -1, 1 )
+
+    return uncertainty * bin_quantiles( u, nensemble, members )
+
+@lru_cache(maxsize=None)
+def taper_template( taper_start, taper_end, t_start, t_end ):
+
+    '''
+    Unit exposure bias taper on the monthly grid [t_start,t_end): 1 before
+    taper_start, decreasing linearly to 0 over the taper months and 0 from
+    taper_end onward. Cached per (taper_start, taper_end) latitude regime.
+    '''
+
+    nmonths = ( t_end - t_start ) * 12
+    idx_start = ( taper_start - t_start ) * 12
+    idx_end = ( taper_end - t_start ) * 12
+    ntaper = idx_end - idx_start
+
+    taper = ( ( ntaper - 1 ) - np.arange( ntaper ) ) / ( ntaper - 1 )
+    template = np.concatenate( [ np.ones( max( idx_start, 0 ) ), taper[ max( -idx_start, 0 ): ], np.zeros( max( nmonths - idx_end, 0 ) ) ] )[:nmonths]
+    template.flags.writeable = False
+
+    return template
+
+def make_timeseries( bias, taper_start, taper_end, t_start, t_end ):
+
+    '''
+    Exposure bias timeseries(es) from the cached unit taper: one multiply.
+    bias: scalar or array --> array of shape bias.shape + (months,)
+    '''
+
+    return np.multiply.outer( bias, taper_template( taper_start, taper_end, t_start, t_end ) )
+
+def station_regimes( lat ):
+
+    '''
+    Regime of each station: 0 = extratropics ( lat < -20 or lat > 20 ), 1 = tropics.
+    '''
+
+    lat = np.asarray( lat, dtype=float )
+    return np.where( ( lat < -20 ) | ( lat > 20 ), 0, 1 )
+
+def scale_templates( out, bias, regime, templates ):
+
+    '''
+    Fill out (members, stations, months) with bias (members, stations) x
+    the unit taper of each station's regime, one regime at a time. Integer
+    out --> CRUTEM scaled integers ( x1000, truncated as in the text files ).
+    '''
+
+    for r in range( len( templates ) ):
+        stations = np.flatnonzero( regime == r )
+        if len( stations ) == 0: continue
+        values = bias[:,stations,np.newaxis] * templates[r]
+        out[:,stations] = ( values * scale_factor ).astype( out.dtype ) if np.issubdtype( out.dtype, np.integer ) else values
+
+def write_timeseries_cube( cube, draw, regime, templates ):
+
+    '''
+    Write the (member, station, year, month) cube of draw( rows ) biases
+    (rows, stations) x regime tapers in batches of member rows bounded by
+    batch_bytes: the biases are drawn batch by batch too, so memory does not
+    grow with the number of members and each member costs one scaled write.
+
+    draw: cube member rows --> (rows, stations) bias
+    '''
+
+    view = cube.reshape( cube.shape[0], cube.shape[1], -1 )
+    step = max( 1, batch_bytes // max( view.shape[1] * view.shape[2] * 8, 1 ) )
+
+    for first in range( 0, view.shape[0], step ):
+        rows = np.arange( first, min( first + step, view.shape[0] ) )
+        scale_templates( view[first:first+step], draw( rows ), regime, templates )
+
+def statistic_names():
+
+    return [ 'mean', 'spread' ] + [ 'p' + format( q, 'g' ) for q in percentiles ]
+
+def ensemble_statistics( bias ):
+
+    '''
+    Ensemble mean, spread ( standard deviation ) and percentiles over
+    members of the per-station biases (members, stations). Every member
+    timeseries is its bias x a non-negative unit taper, so these x the
+    station's taper are exactly the statistics of the timeseries.
+
+    Returns: dict name --> (stations,) ( in statistic_names order )
+    '''
+
+    statistics = {'mean':bias.mean( axis=0 ), 'spread':bias.std( axis=0 )}
+    for q, values in zip( percentiles, np.percentile( bias, percentiles, axis=0 ) ):
+        statistics[ 'p' + format( q, 'g' ) ] = values
+
+    return statistics
+
+def write_large_ensemble( stem, df_stat4, members, draw, regime, t_start, t_end, statistics=False, dtype=np.float32 ):
+
+    '''
+    Large-ensemble mode: write all members as one memory-mappable
+    (member, station, year, month) cube ( stem + '.npy' ), or with
+    statistics=True only the ensemble statistics ( stem + '_statistics.npy',
+    member axis = statistic names ) without generating the member
+    timeseries. The biases are drawn on demand in batches bounded by
+    batch_bytes: of members for the cube, of stations ( all members ) for
+    the statistics.
+
+    members: member numbers ( 0-based ) of the cube
+    draw: ( member numbers, station positions ) --> (members, stations) bias,
+    e.g. from the counter-based stream_equiprobable_bins
+    regime: regime of each station ( station_regimes )
+    '''
+
+    members = np.asarray( members )
+    regime = np.asarray( regime )
+    templates = [ taper_template( taper_start, taper_end, t_start, t_end ) for taper_start, taper_end, uncertainty in regimes ]
+
+    if statistics == True:
+        cube = open_binary( stem + '_statistics', df_stat4, statistic_names(), t_start, t_end, 'exposure_bias' )
+        step = max( 1, batch_bytes // max( len( members ) * draw_bytes, 1 ) )
+        for first in range( 0, len( regime ), step ):
+            stations = np.arange( first, min( first + step, len( regime ) ) )
+            values = np.array( list( ensemble_statistics( draw( members, stations ) ).values() ) )
+            write_timeseries_cube( cube[:,first:first+step], lambda rows: values[ rows ], regime[ stations ], templates )
+    else:
+        cube = open_binary( stem, df_stat4, [ member+1 for member in members ], t_start, t_end, 'exposure_bias', dtype=dtype )
+        stations = np.arange( len( regime ) )
+        write_timeseries_cube( cube, lambda rows: draw( members[ rows ], stations ), regime, templates )
+
+    cube.flush()
+    del cube
+
+#------------------------------------------------------------------------------
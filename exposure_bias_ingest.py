@@ -0,0 +1,119 @@
+#------------------------------------------------------------------------------
+# MODULE: exposure_bias_ingest.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+# Dataframe libraries:
+import numpy as np
+import pandas as pd
+# OS libraries:
+import glob
+import re
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# SETTINGS:
+#------------------------------------------------------------------------------
+
+# Index(['index', 'stationcode', 'exposure_category', 'bias_estimate', 'bias_estimate_2.5', 'bias_estimate_97.5', 'source_flag', 'exposurecorrected_flag'], dtype='object')
+
+model_dtypes = {
+    'index': str,
+    'stationcode': np.int64,
+    'exposure_category': 'category',
+    'bias_estimate': np.float64,
+    'bias_estimate_2.5': np.float64,
+    'bias_estimate_97.5': np.float64,
+    'source_flag': np.float64,
+    'exposurecorrected_flag': np.float64,
+}
+
+#------------------------------------------------------------------------------
+# METHODS
+#------------------------------------------------------------------------------
+
+def natural_key( filename ):
+
+    # Part2 < Part10
+
+    return [ int(token) if token.isdigit() else token for token in re.split( r'(\d+)', filename ) ]
+
+def find_model_parts( pattern ):
+
+    return sorted( glob.glob( pattern ), key=natural_key )
+
+def pad_stationcodes( codes ):
+
+    '''
+    Integer station codes --> categorical of 6-digit zero-padded strings.
+    Only the unique codes are formatted; rows keep integer category codes.
+    '''
+
+    codes, uniques = pd.factorize( codes )
+    categories = pd.Index( uniques ).astype(str).str.zfill(6)
+
+    return pd.Categorical.from_codes( codes, categories=categories )
+
+def read_model_part( modelfile ):
+
+    '''
+    Load one part of Emily's exposure bias model CSV with explicit dtypes and
+    munge it to the df_exposure_bias layout ( columns are taken by position ).
+    '''
+
+    df = pd.read_csv( modelfile, dtype=model_dtypes )
+
+    # CONVERT: timestamps (yyyy-mm-dd --> datetime64) as a column
+
+    datetimes = pd.to_datetime( df[ df.columns[0] ], format='%Y-%m-%d' ).values
+
+    # CONVERT: stationcodes [ NB: int64 --> 6-digit str ] on the unique codes only --> categorical
+
+    stationcodes = pad_stationcodes( df[ df.columns[1] ].values )
+
+    # COMPUTE: 95% c.i. uncertainty ( the 2.5 / 97.5 bounds are kept as bias_2.5 / bias_97.5 )
+
+    uncertainty = df[ df.columns[5] ].values - df[ df.columns[4] ].values
+
+    return pd.DataFrame( {'datetime':datetimes, 'stationcode':stationcodes, 'exposure_category':df[ df.columns[2] ].values, 'bias':df[ df.columns[3] ].values,
+                          'uncertainty':uncertainty, 'source_flag':df[ df.columns[6] ].values, 'exposurecorrected_flag':df[ df.columns[7] ].values,
+                          'bias_2.5':df[ df.columns[4] ].values, 'bias_97.5':df[ df.columns[5] ].values } )
+
+def concat_model_parts( parts ):
+
+    '''
+    Concatenate part dataframes once, keeping stationcode and
+    exposure_category categorical ( parts are recoded to the union of their
+    categories ).
+    '''
+
+    for column in [ 'stationcode', 'exposure_category' ]:
+        categories = sorted( set().union( *[ part[ column ].cat.categories for part in parts ] ) )
+        for part in parts:
+            part[ column ] = part[ column ].cat.set_categories( categories )
+
+    return pd.concat( parts, ignore_index=True )
+
+def read_model_parts( modelfiles, nworkers=None, use_processes=False ):
+
+    '''
+    Load any number of model part files in parallel across a thread ( or
+    process ) pool and concatenate them in file order.
+    '''
+
+    if len( modelfiles ) == 0:
+        raise FileNotFoundError( 'no exposure bias model part files found' )
+
+    executor = ProcessPoolExecutor if use_processes else ThreadPoolExecutor
+    with executor( max_workers=nworkers ) as pool:
+        parts = list( pool.map( read_model_part, modelfiles ) )
+
+    return concat_model_parts( parts )
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,135 @@
+#------------------------------------------------------------------------------
+# MODULE: exposure_bias_manifest.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+# Dataframe libraries:
+import pandas as pd
+# OS libraries:
+import os
+import json
+import hashlib
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# SETTINGS:
+#------------------------------------------------------------------------------
+
+manifest_suffix = '.manifest.json' # manifest persisted next to each output
+hash_chunk_size = 16 * 1024 * 1024
+
+#------------------------------------------------------------------------------
+# METHODS
+#------------------------------------------------------------------------------
+
+def file_hash( path ):
+
+    sha = hashlib.sha256()
+    with open( path, 'rb' ) as f:
+        for chunk in iter( lambda: f.read( hash_chunk_size ), b'' ):
+            sha.update( chunk )
+    return sha.hexdigest()
+
+def station_hashes( df, columns=None ):
+
+    '''
+    Content hash of each station's rows ( in row order ) over the given
+    columns: stationcode --> hex digest. Row hashes are computed in one
+    vectorised pass and combined per station.
+    '''
+
+    if columns is None: columns = list( df.columns )
+
+    row_hashes = pd.util.hash_pandas_object( df[ list( columns ) ], index=False ).values
+    station_rows = df.groupby( 'stationcode', sort=True, observed=True ).indices
+
+    return { str( code ): hashlib.blake2b( row_hashes[ rows ].tobytes(), digest_size=16 ).hexdigest() for code, rows in station_rows.items() }
+
+def changed_stations( old_hashes, new_hashes ):
+
+    '''
+    Stations added, removed or with changed content between two sets of
+    station hashes.
+    '''
+
+    codes = set( old_hashes ) | set( new_hashes )
+    return sorted( code for code in codes if old_hashes.get( code ) != new_hashes.get( code ) )
+
+def manifest_path( output ):
+
+    return output + manifest_suffix
+
+def read_manifest( output ):
+
+    '''
+    Manifest of an output: {'sources': ..., 'stations': ...}, or None if
+    the output or its manifest is missing or unreadable.
+    '''
+
+    if not ( os.path.exists( output ) & os.path.exists( manifest_path( output ) ) ): return None
+    try:
+        with open( manifest_path( output ), 'r' ) as f:
+            return json.load( f )
+    except ( OSError, ValueError ):
+        return None
+
+def write_manifest( output, sources, stations, blocks=None ):
+
+    '''
+    Persist the manifest of an output ( written atomically after the
+    output itself ).
+
+    sources: anything else the output depends on ( input file hashes, settings )
+    stations: stationcode --> content hash of the station inputs
+    blocks: ( stationcodes, offsets ) of a station block file in write order,
+    with the end of the file as the last offset ( None --> not recorded )
+    '''
+
+    manifest = {'sources':sources, 'stations':stations}
+    if blocks is not None:
+        manifest['blocks'] = {'stationcodes':[ str( code ) for code in blocks[0] ], 'offsets':[ int( offset ) for offset in blocks[1] ]}
+
+    tmpfile = manifest_path( output ) + '.tmp'
+    with open( tmpfile, 'w' ) as f:
+        json.dump( manifest, f )
+    os.replace( tmpfile, manifest_path( output ) )
+
+def station_blocks( output, stationcodes ):
+
+    '''
+    Byte ranges of the station blocks of an output as recorded in its
+    manifest when it was written, if it holds exactly stationcodes in that
+    order; None otherwise.
+
+    Returns: dataframe with offset and length ( bytes ) per station
+    '''
+
+    manifest = read_manifest( output )
+    if ( manifest is None ) or ( 'blocks' not in manifest ): return None
+
+    blocks = manifest['blocks']
+    offsets = pd.Series( blocks['offsets'], dtype='int64' )
+    if blocks['stationcodes'] != [ str( code ) for code in stationcodes ]: return None
+    if ( len( offsets ) != len( stationcodes ) + 1 ) or ( offsets.iloc[-1] != os.path.getsize( output ) ): return None
+
+    return pd.DataFrame( {'offset':offsets.values[:-1], 'length':offsets.diff().values[1:].astype( 'int64' )} )
+
+def incremental_stations( output, sources, stations ):
+
+    '''
+    Stations to recompute for an output: None if it must be rebuilt in
+    full ( no manifest, or sources or settings changed ), otherwise the
+    stations whose inputs changed since it was written.
+    '''
+
+    manifest = read_manifest( output )
+    if manifest is None: return None
+    if manifest.get( 'sources' ) != sources: return None
+    return changed_stations( manifest.get( 'stations', {} ), stations )
+
+#------------------------------------------------------------------------------
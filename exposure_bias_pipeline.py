@@ -0,0 +1,239 @@
+#------------------------------------------------------------------------------
+# MODULE: exposure_bias_pipeline.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+# OS libraries:
+import os, sys
+import glob
+import json
+import runpy
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from exposure_bias_manifest import file_hash
+from exposure_bias_store import enable_frame_cache, locate_frame
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# SETTINGS:
+#------------------------------------------------------------------------------
+
+state_file = '.pipeline-state.json' # input hashes of the last successful run of each stage
+script_dir = os.path.dirname( os.path.abspath( __file__ ) ) # stage scripts are found here ( data paths are relative to the working directory )
+
+'''
+Artefact types: 'csv' ( glob of model parts ), 'frame' ( store dataframe ),
+'stat4' / 'crutem' ( CRUTEM text ), 'netcdf', 'png'.
+
+A stage is a dict:
+    script: program run for the stage ( in script_dir )
+    inputs: {path: type} read by the script ( paths may be glob patterns )
+    outputs: {path: type} written by the script
+    publish: {output: [paths]} outputs also made available under the paths later stages read
+'''
+
+#------------------------------------------------------------------------------
+# METHODS
+#------------------------------------------------------------------------------
+
+def stage_outputs( stage ):
+
+    paths = list( stage.get( 'outputs', {} ) )
+    for targets in stage.get( 'publish', {} ).values(): paths += list( targets )
+    return paths
+
+def stage_levels( stages ):
+
+    '''
+    Order stages by dependency ( a stage depends on the stages producing
+    any of its inputs ): list of levels, each a list of stage names that
+    only depend on earlier levels and so can run concurrently.
+    '''
+
+    producers = {}
+    for name, stage in stages.items():
+        for path in stage_outputs( stage ): producers[ path ] = name
+
+    depends = { name: set( producers[ path ] for path in stage.get( 'inputs', {} ) if path in producers ) - { name } for name, stage in stages.items() }
+
+    levels = []
+    done = set()
+    while len( done ) < len( stages ):
+        level = [ name for name in stages if name not in done and depends[ name ] <= done ]
+        if len( level ) == 0:
+            raise ValueError( 'pipeline stages have a dependency cycle: ' + ', '.join( name for name in stages if name not in done ) )
+        levels.append( level )
+        done |= set( level )
+
+    return levels
+
+def upstream( stages, targets ):
+
+    '''
+    Names of the target stages and every stage they depend on.
+    '''
+
+    producers = {}
+    for name, stage in stages.items():
+        for path in stage_outputs( stage ): producers[ path ] = name
+
+    selected = set()
+    pending = list( targets )
+    while len( pending ) > 0:
+        name = pending.pop()
+        if name not in stages: raise ValueError( 'unknown pipeline stage: ' + name )
+        if name in selected: continue
+        selected.add( name )
+        pending += [ producers[ path ] for path in stages[ name ].get( 'inputs', {} ) if path in producers ]
+
+    return selected
+
+def input_paths( pattern, kind ):
+
+    '''
+    Files matching a stage input: frames are resolved as the stage scripts
+    read them ( locate_frame, e.g. the legacy .pkl of a .parquet ), other
+    types by glob.
+    '''
+
+    if kind == 'frame':
+        try:
+            return [ locate_frame( pattern ) ]
+        except FileNotFoundError:
+            return []
+    return sorted( glob.glob( pattern ) )
+
+def input_hashes( stage ):
+
+    '''
+    Content hashes of the script and every input file of a stage ( None if
+    an input is missing ).
+    '''
+
+    hashes = { stage['script']: file_hash( os.path.join( script_dir, stage['script'] ) ) }
+    for pattern, kind in stage.get( 'inputs', {} ).items():
+        paths = input_paths( pattern, kind )
+        if len( paths ) == 0: return None
+        for path in paths: hashes[ path ] = file_hash( path )
+
+    return hashes
+
+def read_state():
+
+    if not os.path.exists( state_file ): return {}
+    try:
+        with open( state_file, 'r' ) as f:
+            return json.load( f )
+    except ( OSError, ValueError ):
+        return {}
+
+def write_state( state ):
+
+    with open( state_file + '.tmp', 'w' ) as f:
+        json.dump( state, f, indent=1 )
+    os.replace( state_file + '.tmp', state_file )
+
+def is_current( stage, hashes, previous ):
+
+    '''
+    A stage is skipped if its script and inputs are unchanged since its last
+    successful run and all of its outputs still exist.
+    '''
+
+    if ( hashes is None ) or ( previous != hashes ): return False
+    return all( len( glob.glob( path ) ) > 0 for path in stage_outputs( stage ) )
+
+def publish( stage ):
+
+    '''
+    Make stage outputs available under the paths later stages read
+    ( hard link where possible, otherwise copy ).
+    '''
+
+    for output, targets in stage.get( 'publish', {} ).items():
+        for target in targets:
+            if os.path.exists( target ) and os.path.samefile( output, target ): continue
+            os.makedirs( os.path.dirname( target ) or '.', exist_ok=True )
+            if os.path.exists( target ): os.remove( target )
+            try:
+                os.link( output, target )
+            except OSError:
+                shutil.copy2( output, target )
+
+def run_script( script, single_process ):
+
+    '''
+    Run a stage script as __main__: in this process ( sharing loaded frames
+    through the store's frame cache ) or as a subprocess.
+    '''
+
+    script = os.path.join( script_dir, script )
+
+    if single_process:
+        argv = sys.argv
+        sys.argv = [ script ]
+        try:
+            runpy.run_path( script, run_name='__main__' )
+        finally:
+            sys.argv = argv
+    else:
+        subprocess.run( [ sys.executable, script ], check=True )
+
+def run_pipeline( stages, targets=None, force=False, single_process=False, njobs=None ):
+
+    '''
+    Run the stages ( and the stages they depend on ) level by level,
+    skipping any whose inputs are unchanged since the last run.
+
+    targets: stage names to run ( None --> all )
+    force: True --> run every selected stage
+    single_process: True --> run the stages one after another in this
+    process, keeping loaded frames in memory across stages; False --> run
+    independent stages concurrently as subprocesses
+    njobs: concurrent stages ( None --> all of a level )
+
+    Returns: dict stage name --> 'ran' | 'skipped'
+    '''
+
+    if targets is not None:
+        selected = upstream( stages, targets )
+        stages = { name: stage for name, stage in stages.items() if name in selected }
+
+    if single_process: enable_frame_cache()
+
+    state = read_state()
+    status = {}
+
+    def run_stage( name ):
+
+        stage = stages[ name ]
+        hashes = input_hashes( stage )
+        if hashes is None:
+            raise FileNotFoundError( 'missing input for stage ' + name + ': ' + ', '.join( pattern for pattern, kind in stage.get( 'inputs', {} ).items() if len( input_paths( pattern, kind ) ) == 0 ) )
+        if ( force == False ) and is_current( stage, hashes, state.get( name ) ):
+            return name, 'skipped', hashes
+        print( '** STAGE', name, '--', stage['script'] )
+        run_script( stage['script'], single_process )
+        publish( stage )
+        return name, 'ran', hashes
+
+    for level in stage_levels( stages ):
+        if single_process or len( level ) == 1:
+            results = [ run_stage( name ) for name in level ]
+        else:
+            with ThreadPoolExecutor( max_workers=njobs or len( level ) ) as pool:
+                results = list( pool.map( run_stage, level ) )
+        for name, result, hashes in results:
+            status[ name ] = result
+            state[ name ] = hashes
+        write_state( state )
+
+    return status
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,300 @@
+#------------------------------------------------------------------------------
+# MODULE: exposure_bias_store.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+# Dataframe libraries:
+import numpy as np
+import pandas as pd
+# OS libraries:
+import os, sys
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# SETTINGS:
+#------------------------------------------------------------------------------
+
+parquet_codec = 'zstd'
+feather_codec = 'lz4'
+row_group_size = 131072         # rows per Parquet row group ( unit of row filtering )
+legacy_compression = 'bz2'      # compression of the legacy .pkl files
+
+frame_cache = None              # in-process cache of loaded frames ( enabled by enable_frame_cache )
+
+#------------------------------------------------------------------------------
+# METHODS
+#------------------------------------------------------------------------------
+
+def import_pyarrow():
+
+    try:
+        import pyarrow
+        import pyarrow.parquet
+        import pyarrow.feather
+    except ImportError:
+        raise ImportError('pyarrow is required for the Parquet and Feather backends ( pip install pyarrow )')
+    return pyarrow
+
+def year_bounds( years ):
+
+    '''
+    (first, last) inclusive year range --> datetime bounds [start, end)
+    '''
+
+    return pd.Timestamp( year=int(years[0]), month=1, day=1 ), pd.Timestamp( year=int(years[1])+1, month=1, day=1 )
+
+def projection( schema_names, columns ):
+
+    '''
+    Columns to read: the requested columns plus any filter keys present.
+    '''
+
+    if columns is None: return None
+    return list( columns ) + [ c for c in ['stationcode','year','datetime'] if c in schema_names and c not in columns ]
+
+def arrow_filters( schema_names, stationcodes, years ):
+
+    filters = []
+    if stationcodes is not None:
+        filters.append( ( 'stationcode', 'in', list( stationcodes ) ) )
+    if years is not None:
+        if 'year' in schema_names:
+            filters += [ ( 'year', '>=', int(years[0]) ), ( 'year', '<=', int(years[1]) ) ]
+        elif 'datetime' in schema_names:
+            start, end = year_bounds( years )
+            filters += [ ( 'datetime', '>=', start ), ( 'datetime', '<', end ) ]
+    return filters if len( filters ) > 0 else None
+
+def filter_frame( df, stationcodes, years ):
+
+    '''
+    Row filtering for backends without predicate pushdown.
+    '''
+
+    mask = np.ones( len(df), dtype=bool )
+    if stationcodes is not None:
+        mask &= df.stationcode.isin( list( stationcodes ) ).values
+    if years is not None:
+        if 'year' in df.columns:
+            mask &= ( ( df.year >= years[0] ) & ( df.year <= years[1] ) ).values
+        elif 'datetime' in df.columns:
+            start, end = year_bounds( years )
+            mask &= ( ( df.datetime >= start ) & ( df.datetime < end ) ).values
+    return df if mask.all() else df[ mask ].reset_index(drop=True)
+
+# PARQUET: column projection + row-group filtering on stationcode and year range
+
+def read_parquet( path, columns, stationcodes, years ):
+
+    pa = import_pyarrow()
+    schema_names = pa.parquet.read_schema( path ).names
+    table = pa.parquet.read_table( path, columns=projection( schema_names, columns ), filters=arrow_filters( schema_names, stationcodes, years ) )
+    df = table.to_pandas()
+    return df if columns is None else df[ list( columns ) ]
+
+def write_parquet( df, path ):
+
+    pa = import_pyarrow()
+    table = pa.Table.from_pandas( df, preserve_index=False )
+    pa.parquet.write_table( table, path, compression=parquet_codec, row_group_size=row_group_size )
+
+# FEATHER: Arrow IPC with column projection; rows are filtered after reading
+
+def read_feather( path, columns, stationcodes, years ):
+
+    pa = import_pyarrow()
+    schema_names = pa.ipc.open_file( path ).schema.names
+    df = pa.feather.read_table( path, columns=projection( schema_names, columns ) ).to_pandas()
+    df = filter_frame( df, stationcodes, years )
+    return df if columns is None else df[ list( columns ) ]
+
+def write_feather( df, path ):
+
+    pa = import_pyarrow()
+    pa.feather.write_feather( df.reset_index(drop=True), path, compression=feather_codec )
+
+# PICKLE: legacy bz2 pickles
+
+def read_pickle( path, columns, stationcodes, years ):
+
+    df = pd.read_pickle( path, compression=legacy_compression )
+    df = filter_frame( df, stationcodes, years )
+    return df if columns is None else df[ list( columns ) ]
+
+def write_pickle( df, path ):
+
+    df.to_pickle( path, compression=legacy_compression )
+
+backends = {
+    '.parquet': ( read_parquet, write_parquet ),
+    '.feather': ( read_feather, write_feather ),
+    '.pkl': ( read_pickle, write_pickle ),
+}
+
+def backend( path ):
+
+    extension = os.path.splitext( path )[1]
+    if extension not in backends:
+        raise ValueError( 'unknown storage format: ' + path + ' ( expected one of ' + ', '.join( backends ) + ' )' )
+    return backends[ extension ]
+
+def locate_frame( path ):
+
+    '''
+    Resolve a dataframe file: the path itself if it exists, otherwise any
+    sibling with the same stem in another backend format ( e.g. the legacy
+    .pkl of a requested .parquet ).
+    '''
+
+    if os.path.exists( path ): return path
+    stem = os.path.splitext( path )[0]
+    for extension in backends:
+        if os.path.exists( stem + extension ): return stem + extension
+    raise FileNotFoundError( path )
+
+def frame_columns( path ):
+
+    '''
+    Column names of a stored dataframe, read from the file schema. Legacy
+    pickles have no schema: they are loaded once into the frame cache
+    ( enable_frame_cache ), so the read_frame that follows reuses them.
+    '''
+
+    path = locate_frame( path )
+    extension = os.path.splitext( path )[1]
+
+    if extension == '.parquet':
+        return list( import_pyarrow().parquet.ParquetFile( path ).schema_arrow.names )
+    if extension == '.feather':
+        return list( import_pyarrow().ipc.open_file( path ).schema.names )
+    enable_frame_cache()
+    return list( cached_frame( path ).columns )
+
+def enable_frame_cache():
+
+    '''
+    Keep every frame loaded in this process in memory so later reads of the
+    same file ( any columns or row filters ) skip the disk. Entries are keyed
+    by file identity and mtime, so a rewritten file is read again.
+    '''
+
+    global frame_cache
+    if frame_cache is None: frame_cache = {}
+
+def cached_frame( path ):
+
+    '''
+    Whole frame of a file from the frame cache ( loaded on first use ).
+    '''
+
+    stat = os.stat( path )
+    key = ( stat.st_dev, stat.st_ino, stat.st_mtime_ns, stat.st_size )
+    if key not in frame_cache:
+        reader, writer = backend( path )
+        frame_cache[ key ] = reader( path, None, None, None )
+    return frame_cache[ key ]
+
+def read_frame( path, columns=None, stationcodes=None, years=None ):
+
+    '''
+    Load a dataframe from the store.
+
+    columns: subset of columns to read ( None --> all )
+    stationcodes: subset of stations to read ( None --> all )
+    years: (first, last) inclusive year range on 'year' or 'datetime' ( None --> all )
+    '''
+
+    path = locate_frame( path )
+    reader, writer = backend( path )
+
+    if frame_cache is None:
+        return reader( path, columns, stationcodes, years )
+
+    df = filter_frame( cached_frame( path ), stationcodes, years )
+    return ( df if columns is None else df[ list( columns ) ] ).copy()
+
+def write_frame( df, path ):
+
+    reader, writer = backend( path )
+    writer( df, path )
+
+def iter_frame( path, chunk_rows, columns=None, stationcodes=None, years=None ):
+
+    '''
+    Stream a dataframe from the store in chunks of at most chunk_rows rows
+    ( before row filtering ). Parquet is read batch by batch and Feather is
+    memory-mapped, so memory is bounded by the chunk size; legacy pickles
+    are loaded whole and then sliced. If no rows match, one empty chunk is
+    yielded so consumers still see the columns.
+    '''
+
+    path = locate_frame( path )
+    extension = os.path.splitext( path )[1]
+
+    if extension == '.parquet':
+        pa = import_pyarrow()
+        parquet_file = pa.parquet.ParquetFile( path )
+        batches = ( batch.to_pandas() for batch in parquet_file.iter_batches( batch_size=chunk_rows, columns=projection( parquet_file.schema_arrow.names, columns ) ) )
+        empty = lambda: parquet_file.schema_arrow.empty_table().to_pandas()
+    elif extension == '.feather':
+        pa = import_pyarrow()
+        table = pa.feather.read_table( path, columns=projection( pa.ipc.open_file( path ).schema.names, columns ), memory_map=True )
+        batches = ( table.slice( start, chunk_rows ).to_pandas() for start in range( 0, table.num_rows, chunk_rows ) )
+        empty = lambda: table.slice( 0, 0 ).to_pandas()
+    else:
+        frame = read_frame( path )
+        batches = ( frame.iloc[ start:start+chunk_rows ] for start in range( 0, len(frame), chunk_rows ) )
+        empty = lambda: frame.iloc[:0]
+
+    nchunks = 0
+    for batch in batches:
+        df = filter_frame( batch.reset_index(drop=True), stationcodes, years )
+        if len(df) == 0: continue
+        nchunks += 1
+        yield df if columns is None else df[ list( columns ) ]
+
+    if nchunks == 0:
+        df = empty().reset_index(drop=True)
+        yield df if columns is None else df[ list( columns ) ]
+
+def write_frame_chunks( chunks, paths ):
+
+    '''
+    Append streamed dataframes to Parquet files as they arrive: chunks
+    yields one dataframe per path and each is written as row groups of
+    the open file, so no output is held in memory.
+    '''
+
+    for path in paths:
+        if os.path.splitext( path )[1] != '.parquet':
+            raise ValueError( 'chunked output requires the Parquet backend: ' + path )
+
+    pa = import_pyarrow()
+    writers = [ None ] * len( paths )
+    try:
+        for frames in chunks:
+            for k, df in enumerate( frames ):
+                if writers[k] is None:
+                    table = pa.Table.from_pandas( df, preserve_index=False )
+                    writers[k] = pa.parquet.ParquetWriter( paths[k], table.schema, compression=parquet_codec )
+                else:
+                    table = pa.Table.from_pandas( df, schema=writers[k].schema, preserve_index=False )
+                writers[k].write_table( table, row_group_size=row_group_size )
+    finally:
+        for writer in writers:
+            if writer is not None: writer.close()
+
+#------------------------------------------------------------------------------
+if __name__ == "__main__":
+
+    # CONVERT: legacy .pkl files to Parquet
+
+    for path in sys.argv[1:]:
+        outfile = os.path.splitext( path )[0] + '.parquet'
+        write_frame( read_frame( path ), outfile )
+        print( path, '-->', outfile )
@@ -0,0 +1,239 @@
+#------------------------------------------------------------------------------
+# MODULE: exposure_bias_zonal.py
+#------------------------------------------------------------------------------
+# Version 0.1
+# glosat-exposure-bias-ensemble contributors
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# IMPORT PYTHON LIBRARIES
+#------------------------------------------------------------------------------
+# Dataframe libraries:
+import numpy as np
+import pandas as pd
+import netCDF4
+import os
+from functools import lru_cache
+from exposure_bias_engine import months
+#------------------------------------------------------------------------------
+
+#------------------------------------------------------------------------------
+# SETTINGS:
+#------------------------------------------------------------------------------
+
+sftof_chunk_rows = 30           # latitude rows of the sftof grid read per chunk
+profile_suffix = '.zonal.npz'   # zonal land fraction profile persisted next to the sftof file
+
+#------------------------------------------------------------------------------
+# METHODS
+#------------------------------------------------------------------------------
+
+def zone_edges( latstep ):
+
+    if 180 % latstep != 0:
+        raise ValueError( 'latstep must divide 180 degrees: ' + str( latstep ) )
+    return np.arange( -90, 90 + latstep, latstep )
+
+def zone_centres( latstep ):
+
+    return np.arange( -90 + latstep/2, 90 + latstep/2, latstep )
+
+def zone_index( lat, latstep ):
+
+    '''
+    Zone of each latitude for zones ( edges[i], edges[i+1] ]: -1 or nzones
+    for latitudes outside ( -90, 90 ] or NaN.
+    '''
+
+    return np.digitize( lat, zone_edges( latstep ), right=True ) - 1
+
+def zonal_lat_weights( latstep ):
+
+    return np.abs( np.cos( ( zone_centres( latstep ) / 180 ) * np.pi ) )
+
+def reduce_sftof( sftof_file ):
+
+    '''
+    Zonal mean of the sftof grid ( % ) over longitude, read in blocks of
+    sftof_chunk_rows latitude rows so the full grid is never held in memory.
+    '''
+
+    with netCDF4.Dataset( sftof_file, "r" ) as nc:
+        variable = nc.variables["sftof"]
+        nlat = variable.shape[0]
+        profile = []
+        for start in range( 0, nlat, sftof_chunk_rows ):
+            block = np.ma.filled( variable[ start:start+sftof_chunk_rows, : ], 0.0 )
+            profile.append( np.nanmean( block, axis=1 ) )
+
+    return np.concatenate( profile )
+
+@lru_cache(maxsize=None)
+def land_fraction_profile( sftof_file ):
+
+    '''
+    Zonal mean land fraction per degree of latitude ( fraction, not % )
+    from the 1x1 degree sftof grid. Cached per file in memory and on disk
+    next to the source ( sftof_file + '.zonal.npz' ), rebuilt if the sftof
+    mtime or size has changed, so repeat runs skip the NetCDF read.
+    '''
+
+    stat = os.stat( sftof_file )
+    profilefile = sftof_file + profile_suffix
+
+    profile = None
+    if os.path.exists( profilefile ):
+        try:
+            with np.load( profilefile ) as f:
+                if ( f['mtime_ns'] == stat.st_mtime_ns ) & ( f['size'] == stat.st_size ):
+                    profile = f['profile']
+        except ( OSError, ValueError, KeyError ):
+            pass
+
+    if profile is None:
+        profile = reduce_sftof( sftof_file )
+        try:
+            with open( profilefile, 'wb' ) as f:
+                np.savez( f, mtime_ns=stat.st_mtime_ns, size=stat.st_size, profile=profile )
+        except OSError:
+            pass # read-only location --> profile is rebuilt on the next run
+
+    profile = profile[::-1] / 100
+    profile.flags.writeable = False
+
+    return profile
+
+@lru_cache(maxsize=None)
+def zonal_weights( sftof_file, latstep ):
+
+    '''
+    Zonal weights cos( zone centre ) x zone mean land fraction. Cached per
+    latstep.
+
+    Returns: lat weights, land weights, combined weights ( one per zone )
+    '''
+
+    nzones = len( zone_edges( latstep ) ) - 1
+
+    lat_weight = zonal_lat_weights( latstep )
+    land_weight = np.nanmean( land_fraction_profile( sftof_file ).reshape( nzones, latstep ), axis=1 )
+    weight = lat_weight * land_weight
+
+    for array in [ lat_weight, land_weight, weight ]: array.flags.writeable = False
+
+    return lat_weight, land_weight, weight
+
+def degree_sums( df ):
+
+    '''
+    Sums and counts of each month column per (1 degree zone, year), the
+    building block of every coarser latstep ( zone edges are nested ).
+
+    Returns: dict of years, sums and counts (180, years, 12) and station
+    rows (180, years)
+    '''
+
+    zone = zone_index( df.stationlat.values, 1 )
+    inside = ( zone >= 0 ) & ( zone < 180 )
+
+    years = df.year.values[ inside ].astype( np.int64 )
+    year0 = years.min()
+    nyears = years.max() - year0 + 1
+
+    values = df[ months ].values[ inside ].astype( float )
+    valid = ~np.isnan( values )
+    idx = ( ( zone[ inside ] * nyears + years - year0 )[:,np.newaxis] * 12 + np.arange(12) ).ravel()
+
+    sums = np.bincount( idx, weights=np.where( valid, values, 0.0 ).ravel(), minlength=180*nyears*12 ).reshape( 180, nyears, 12 )
+    counts = np.bincount( idx, weights=valid.ravel(), minlength=180*nyears*12 ).reshape( 180, nyears, 12 )
+    nrows = np.bincount( zone[ inside ] * nyears + years - year0, minlength=180*nyears ).reshape( 180, nyears )
+
+    return {'years':year0 + np.arange( nyears ), 'sums':sums, 'counts':counts, 'nrows':nrows}
+
+def aggregate_zones( degree, latstep ):
+
+    '''
+    Zonal annual means at any latstep by summing the 1 degree sums and
+    counts over each zone ( same result as binning the stations at latstep ).
+
+    Returns: series indexed by (zone, year)
+    '''
+
+    nzones = len( zone_edges( latstep ) ) - 1
+    nyears = len( degree['years'] )
+
+    sums = degree['sums'].reshape( nzones, latstep, nyears, 12 ).sum( axis=1 )
+    counts = degree['counts'].reshape( nzones, latstep, nyears, 12 ).sum( axis=1 )
+    nrows = degree['nrows'].reshape( nzones, latstep, nyears ).sum( axis=1 )
+
+    reporting = counts > 0
+    nmonths = reporting.sum( axis=2 )
+    with np.errstate( invalid='ignore', divide='ignore' ):
+        monthly = np.where( reporting, sums / counts, 0.0 )
+        annual = np.where( nmonths > 0, monthly.sum( axis=2 ) / nmonths, np.nan )
+
+    zone, year = np.nonzero( nrows )
+    index = pd.MultiIndex.from_arrays( [ zone, degree['years'][ year ] ], names=[ 'zone', 'year' ] )
+
+    return pd.Series( annual[ zone, year ], index=index )
+
+def hemisphere_weights( sftof_file ):
+
+    '''
+    NH, SH weights: the latstep = 90 zonal weights ( cos(45) x hemisphere
+    mean land fraction ).
+    '''
+
+    return zonal_weights( sftof_file, 90 )[2][::-1].copy()
+
+def hemisphere_fractions( latstep ):
+
+    '''
+    Fraction of each zone lying in the NH and SH ( a zone straddling the
+    equator is split by latitude ).
+    '''
+
+    edges = zone_edges( latstep )
+    nh = np.clip( edges[1:], 0, None ) - np.clip( edges[:-1], 0, None )
+    sh = np.clip( edges[1:], None, 0 ) - np.clip( edges[:-1], None, 0 )
+
+    return nh / latstep, sh / latstep
+
+def area_weighted_means( zonal, weight, latstep, hemisphere_weight=None ):
+
+    '''
+    Area-weighted NH, SH and global series from zonal annual means: the
+    weighted mean over the zones reporting each year.
+
+    zonal: series indexed by (zone, year) from aggregate_zones
+    weight: one weight per zone
+    hemisphere_weight: NH, SH weights --> global as the weighted mean of the
+    hemispheres ( None --> weighted mean over all zones )
+    Returns: dataframe indexed by year with columns NH, SH, GL
+    '''
+
+    table = zonal.unstack( 'zone' ).reindex( columns=np.arange( len( weight ) ) )
+    values = table.values
+    valid = ~np.isnan( values )
+
+    nh, sh = hemisphere_fractions( latstep )
+
+    series = {}
+    for region, fraction in [ ( 'NH', nh ), ( 'SH', sh ), ( 'GL', np.ones( len( weight ) ) ) ]:
+        w = weight * fraction
+        numerator = np.where( valid, values * w, 0.0 ).sum( axis=1 )
+        denominator = np.where( valid, w, 0.0 ).sum( axis=1 )
+        with np.errstate( invalid='ignore', divide='ignore' ):
+            series[ region ] = np.where( denominator > 0, numerator / denominator, np.nan )
+
+    if hemisphere_weight is not None:
+        hemispheres = np.column_stack( [ series['NH'], series['SH'] ] )
+        valid = ~np.isnan( hemispheres )
+        numerator = np.where( valid, hemispheres * hemisphere_weight, 0.0 ).sum( axis=1 )
+        denominator = np.where( valid, hemisphere_weight, 0.0 ).sum( axis=1 )
+        with np.errstate( invalid='ignore', divide='ignore' ):
+            series['GL'] = np.where( denominator > 0, numerator / denominator, np.nan )
+
+    return pd.DataFrame( series, index=table.index )
+
+#------------------------------------------------------------------------------
@@ -16,6 +16,9 @@
 import numpy as np
 import pandas as pd
 import pickle
+from exposure_bias_store import read_frame, write_frame
+from exposure_bias_engine import months
+from exposure_bias_zonal import zone_edges, zone_centres, zonal_weights, degree_sums, aggregate_zones, hemisphere_weights, area_weighted_means
 import xarray as xr
 import netCDF4
 # Plotting libraries:
@@ -29,134 +32,129 @@ import seaborn as sns; sns.set()
 
 fontsize = 16
 
-df_temp_file = 'DATA/df_temp_qc.pkl'
-df_ebm_file = 'DATA/df_exposure_bias.pkl'
-df_temp_ebc_file = 'OUT/df_temp_ebc.pkl'
-df_ebc_file = 'OUT/df_ebc.pkl'
+df_temp_file = 'DATA/df_temp_qc.parquet'
+df_ebm_file = 'DATA/df_exposure_bias.parquet'
+df_temp_ebc_file = 'OUT/df_temp_ebc.parquet'
+df_ebc_file = 'OUT/df_ebc.parquet'
 sftof_file = 'DATA/sftof.nc' # CMPI6 climatological land/sea mask for zonal land weighting
 
 tstart, tend = 1781, 2022
 nsmooth = 60 # months
 
 latstep = 5
+use_all_latsteps = True        # (default=True) True --> zonal outputs for every latstep in latsteps from one run
+latsteps = [ 5, 10, 15, 30, 60, 90 ]
     
 #------------------------------------------------------------------------------
-# LOAD: dataframes
+# LOAD: exposure bias correction dataframe ( the only input the zonal plots use )
 #------------------------------------------------------------------------------
 
-# LOAD: temperature .pkl file
-df_temp = pd.read_pickle( df_temp_file, compression='bz2' )
-
-# LOAD: EBC temperature .pkl file
-df_temp_ebc = pd.read_pickle( df_temp_ebc_file, compression='bz2' )
-
-# LOAD: exposure bias correction dataframe
-df_ebc = pd.read_pickle( df_ebc_file, compression='bz2' )
-
-# LOAD: exposure bias model
-df_ebm = pd.read_pickle( df_ebm_file, compression='bz2' )
+df_ebc = read_frame( df_ebc_file, columns=[ 'year' ] + months + [ 'stationlat' ], years=( tstart, tend ) )
 
 #------------------------------------------------------------------------------
 # TRIM: to GloSAT year range [1781,2022]
 #------------------------------------------------------------------------------
 
-df_temp = df_temp[ ( df_temp.year >= tstart ) & ( df_temp.year <= tend ) ]
-df_temp_ebc = df_temp_ebc[ ( df_temp_ebc.year >= tstart ) & ( df_temp_ebc.year <= tend ) ]
 df_ebc = df_ebc[ ( df_ebc.year >= tstart ) & ( df_ebc.year <= tend ) ]
 
 #------------------------------------------------------------------------------
-# COMPUTE: zonal aweighting
+# COMPUTE: 1 degree zonal sums ( aggregated up to each latstep ) and hemispherical weights
 #------------------------------------------------------------------------------
 
-# COMPUTE: Zonal latitude weights
+degree_sums_ebc = degree_sums( df_ebc )
 
-zones = np.arange(-90,90+latstep,latstep) # zone boundaries
-zones_per_degree = np.arange(-90,90+1,1) # zone boundaries oer degree
-zone_bins = np.arange(-90+latstep/2, 90+latstep/2, latstep)
-zone_bins_per_degree = np.arange(-90+1/2, 90+1/2, 1)
+zone_bins_per_degree = zone_centres( 1 )
+zonal_lat_weight_per_degree, zonal_land_weight_per_degree, zonal_weight_per_degree = zonal_weights( sftof_file, 1 )
 
-zonal_lat_weight_per_degree = []
-for i in zone_bins_per_degree:
-    zonal_lat_weight_per_degree.append( np.abs( np.cos( (i/180) * np.pi ) ) )
-zonal_lat_weight_per_degree = np.array( zonal_lat_weight_per_degree )
-zonal_lat_weight = []
-for i in zone_bins:
-    zonal_lat_weight.append( np.abs( np.cos( (i/180) * np.pi ) ) )
-zonal_lat_weight = np.array( zonal_lat_weight )
+zonal_weight_hemisphere = hemisphere_weights( sftof_file ) # NH,SH from the latstep = 90 zonal weights
 
-# COMPUTE: Zonal land fraction weights
+if use_all_latsteps == False: latsteps = [ latstep ]
 
-nc = netCDF4.Dataset( sftof_file, "r") # 1x1 degree
-lats = nc.variables["lat"][:]
-lons = nc.variables["lon"][:]
-sftof = np.ma.filled(nc.variables["sftof"][:,:],0.0)
-nc.close()
-zonal_land_weight_per_degree = np.nanmean( sftof, axis=1 ) # per degree
-zonal_land_weight_per_degree = zonal_land_weight_per_degree[::-1]/100
-zonal_land_weight = []
-zones_dict = dict( zip( zones_per_degree, np.arange(len(zonal_land_weight_per_degree)+1) ) )
-for i in range(len(zones)-1):  
-    weight_land = np.nanmean( zonal_land_weight_per_degree[ zones_dict[zones[i]] : zones_dict[zones[i]+latstep] ] )
-    print(i, zones[i], weight_land)
-    zonal_land_weight.append( weight_land ) 
-zonal_land_weight = np.array( zonal_land_weight )
+for latstep in latsteps:
 
-# COMBINE: weights
+    #------------------------------------------------------------------------------
+    # COMPUTE: zonal aweighting
+    #------------------------------------------------------------------------------
 
-zonal_weight = zonal_lat_weight * zonal_land_weight
-zonal_weight_per_degree = zonal_lat_weight_per_degree * zonal_land_weight_per_degree
+    # COMPUTE: Zonal latitude x land fraction weights ( cached per latstep )
 
-# HEMISPHERICAL: weights
+    zones = zone_edges( latstep ) # zone boundaries
+    zone_bins = zone_centres( latstep )
+    zonal_lat_weight, zonal_land_weight, zonal_weight = zonal_weights( sftof_file, latstep )
 
-zonal_weight_hemisphere = np.array([ 0.49577966, 0.43426979]) # NH,SH computed from latstep = 90 run
+    # COMPUTE: zonal annual means and area-weighted hemispheric and global means
 
-#==============================================================================
-# PLOTS
-#==============================================================================
+    zonal_mean_ebc = aggregate_zones( degree_sums_ebc, latstep )
+    area_weighted_ebc = area_weighted_means( zonal_mean_ebc, zonal_weight, latstep, zonal_weight_hemisphere )
 
-#------------------------------------------------------------------------------
-# PLOT: zonal area-weights
-#------------------------------------------------------------------------------
+    #==============================================================================
+    # PLOTS
+    #==============================================================================
 
-figstr = 'zonal-weighting' + '-' + str(latstep).zfill(2) + '.png'
-titlestr = 'Zonal weights: ' + str(latstep) + r'$^{\circ}$ bins with land fraction weighting'
-xstr = 'Weight'
-ystr = 'Latitude, °N'
-
-fig, ax = plt.subplots(figsize=(15,10))          
-plt.plot( zonal_lat_weight_per_degree, zone_bins_per_degree,'^-', label='Cos(lat): ' + str(1) + r'$^{\circ}$' )
-plt.plot( zonal_weight_per_degree, zone_bins_per_degree,'o-', label='Cos(lat)*sftof: ' + str(1) + r'$^{\circ}$' )
-plt.plot( zonal_weight, zone_bins,'v-', label='Cos(lat)*sftof: ' + str(latstep) + r'$^{\circ}$' )
-plt.tick_params(labelsize=fontsize)    
-plt.legend(loc='lower right', ncol=1, fontsize=12)
-plt.xlabel(xstr, fontsize=fontsize)
-plt.ylabel(ystr, fontsize=fontsize)
-plt.title( titlestr, fontsize=fontsize)
-plt.savefig(figstr, dpi=300, bbox_inches='tight')
-plt.close(fig)
+    #------------------------------------------------------------------------------
+    # PLOT: zonal area-weights
+    #------------------------------------------------------------------------------
 
-#------------------------------------------------------------------------------
-# PLOT: zonal area-weighted EBC
-#------------------------------------------------------------------------------
+    figstr = 'zonal-weighting' + '-' + str(latstep).zfill(2) + '.png'
+    titlestr = 'Zonal weights: ' + str(latstep) + r'$^{\circ}$ bins with land fraction weighting'
+    xstr = 'Weight'
+    ystr = 'Latitude, °N'
+
+    fig, ax = plt.subplots(figsize=(15,10))          
+    plt.plot( zonal_lat_weight_per_degree, zone_bins_per_degree,'^-', label='Cos(lat): ' + str(1) + r'$^{\circ}$' )
+    plt.plot( zonal_weight_per_degree, zone_bins_per_degree,'o-', label='Cos(lat)*sftof: ' + str(1) + r'$^{\circ}$' )
+    plt.plot( zonal_weight, zone_bins,'v-', label='Cos(lat)*sftof: ' + str(latstep) + r'$^{\circ}$' )
+    plt.tick_params(labelsize=fontsize)    
+    plt.legend(loc='lower right', ncol=1, fontsize=12)
+    plt.xlabel(xstr, fontsize=fontsize)
+    plt.ylabel(ystr, fontsize=fontsize)
+    plt.title( titlestr, fontsize=fontsize)
+    plt.savefig(figstr, dpi=300, bbox_inches='tight')
+    plt.close(fig)
+
+    #------------------------------------------------------------------------------
+    # PLOT: zonal area-weighted EBC
+    #------------------------------------------------------------------------------
 
-figstr = 'zonal-mean-ebc' + '-' + str(latstep).zfill(2) + '.png'
-titlestr = 'Zonal EBC: ' + str(latstep) + r'$^{\circ}$ bins with land fraction weighting'
-xstr = 'Year'
-ystr = 'Bias, °C'
-
-fig, ax = plt.subplots(figsize=(15,10))          
-for i in range(len(zones)-1):  
-    zonal_mean = df_ebc[ ( df_ebc.stationlat > zones[i] ) & ( df_ebc.stationlat <= zones[i+1] ) ].groupby('year').mean().iloc[:,0:12].mean(axis=1) * zonal_weight[i]
-    zonal_mean_rms = np.sqrt( np.nanmean( zonal_mean**2.0 ) ) 
-    if zonal_mean_rms > 0:
-        plt.plot( zonal_mean, label = '[' + str(zones[i]) + ',' + str(zones[i+1]) + ']' + r'$^{\circ}$ latitude')
-plt.tick_params(labelsize=fontsize)    
-plt.legend(loc='lower right', ncol=1, fontsize=12)
-plt.xlabel(xstr, fontsize=fontsize)
-plt.ylabel(ystr, fontsize=fontsize)
-plt.title( titlestr, fontsize=fontsize)
-plt.savefig(figstr, dpi=300, bbox_inches='tight')
-plt.close(fig)
+    figstr = 'zonal-mean-ebc' + '-' + str(latstep).zfill(2) + '.png'
+    titlestr = 'Zonal EBC: ' + str(latstep) + r'$^{\circ}$ bins with land fraction weighting'
+    xstr = 'Year'
+    ystr = 'Bias, °C'
+
+    fig, ax = plt.subplots(figsize=(15,10))          
+    for i in zonal_mean_ebc.index.unique( level='zone' ):  
+        zonal_mean = zonal_mean_ebc.xs( i, level='zone' ) * zonal_weight[i]
+        zonal_mean_rms = np.sqrt( np.nanmean( zonal_mean**2.0 ) ) 
+        if zonal_mean_rms > 0:
+            plt.plot( zonal_mean, label = '[' + str(zones[i]) + ',' + str(zones[i+1]) + ']' + r'$^{\circ}$ latitude')
+    plt.tick_params(labelsize=fontsize)    
+    plt.legend(loc='lower right', ncol=1, fontsize=12)
+    plt.xlabel(xstr, fontsize=fontsize)
+    plt.ylabel(ystr, fontsize=fontsize)
+    plt.title( titlestr, fontsize=fontsize)
+    plt.savefig(figstr, dpi=300, bbox_inches='tight')
+    plt.close(fig)
+            
+    #------------------------------------------------------------------------------
+    # PLOT: area-weighted hemispheric and global EBC
+    #------------------------------------------------------------------------------
+
+    figstr = 'area-weighted-mean-ebc' + '-' + str(latstep).zfill(2) + '.png'
+    titlestr = 'Area-weighted EBC: ' + str(latstep) + r'$^{\circ}$ bins with land fraction weighting'
+    xstr = 'Year'
+    ystr = 'Bias, °C'
+
+    fig, ax = plt.subplots(figsize=(15,10))          
+    plt.plot( area_weighted_ebc.NH, ls='-', lw=1, color='red', label='NH' )
+    plt.plot( area_weighted_ebc.SH, ls='-', lw=1, color='blue', label='SH' )
+    plt.plot( area_weighted_ebc.GL, ls='-', lw=3, color='black', label='Global' )
+    plt.tick_params(labelsize=fontsize)    
+    plt.legend(loc='lower right', ncol=1, fontsize=12)
+    plt.xlabel(xstr, fontsize=fontsize)
+    plt.ylabel(ystr, fontsize=fontsize)
+    plt.title( titlestr, fontsize=fontsize)
+    plt.savefig(figstr, dpi=300, bbox_inches='tight')
+    plt.close(fig)
             
 #------------------------------------------------------------------------------
 print('** END')
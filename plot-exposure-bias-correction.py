@@ -16,6 +16,8 @@
 import numpy as np
 import pandas as pd
 import pickle
+from exposure_bias_store import read_frame, write_frame
+from exposure_bias_cube import load_cube, cube_means
 import xarray as xr
 import netCDF4
 # Plotting libraries:
@@ -31,10 +33,10 @@ import random
 
 fontsize = 16
 
-df_temp_file = 'DATA/df_temp_qc.pkl'
-df_ebm_file = 'DATA/df_exposure_bias.pkl'
-df_temp_ebc_file = 'OUT/df_temp_ebc.pkl'
-df_ebc_file = 'OUT/df_ebc.pkl'
+df_temp_file = 'DATA/df_temp_qc.parquet'
+df_ebm_file = 'DATA/df_exposure_bias.parquet'
+df_temp_ebc_file = 'OUT/df_temp_ebc.parquet'
+df_ebc_file = 'OUT/df_ebc.parquet'
 sftof_file = 'DATA/sftof.nc' # land/sea mask for zonal weighting
 
 plot_random_stations = False
@@ -43,28 +45,21 @@ tstart, tend = 1781, 2022
 ndraws = 10 # number of randomly selected EBC stations
     
 #------------------------------------------------------------------------------
-# LOAD: dataframes 
+# LOAD: (region, year, month) aggregation cubes ( memoized in CACHE/ by input file hash )
 #------------------------------------------------------------------------------
 
-# LOAD: temperature .pkl file
-df_temp = pd.read_pickle( df_temp_file, compression='bz2' )
+cube_temp = load_cube( df_temp_file )
+cube_temp_ebc = load_cube( df_temp_ebc_file )
+cube_ebc = load_cube( df_ebc_file )
 
-# LOAD: EBC temperature .pkl file
-df_temp_ebc = pd.read_pickle( df_temp_ebc_file, compression='bz2' )
+# SLICE: hemispherical (year, month) means trimmed to GloSAT year range [1781,2022]
 
-# LOAD: exposure bias correction dataframe
-df_ebc = pd.read_pickle( df_ebc_file, compression='bz2' )
-
-# LOAD: exposure bias model
-df_ebm = pd.read_pickle( df_ebm_file, compression='bz2' )
-
-#------------------------------------------------------------------------------
-# TRIM: to GloSAT year range [1781,2022]
-#------------------------------------------------------------------------------
-
-df_temp = df_temp[ ( df_temp.year >= tstart ) & ( df_temp.year <= tend ) ]
-df_temp_ebc = df_temp_ebc[ ( df_temp_ebc.year >= tstart ) & ( df_temp_ebc.year <= tend ) ]
-df_ebc = df_ebc[ ( df_ebc.year >= tstart ) & ( df_ebc.year <= tend ) ]
+nh_temp = cube_means( cube_temp, 'NH', years=( tstart, tend ) )
+sh_temp = cube_means( cube_temp, 'SH', years=( tstart, tend ) )
+nh_temp_ebc = cube_means( cube_temp_ebc, 'NH', years=( tstart, tend ) )
+sh_temp_ebc = cube_means( cube_temp_ebc, 'SH', years=( tstart, tend ) )
+nh_ebc = cube_means( cube_ebc, 'NH', years=( tstart, tend ) )
+sh_ebc = cube_means( cube_ebc, 'SH', years=( tstart, tend ) )
 
 #==============================================================================
 # PLOTS
@@ -79,15 +74,15 @@ xstr = 'Year'
 ystr = 'Temperature, °C'
 
 fig, ax = plt.subplots(2,1,sharex=True,figsize=(15,10))          
-ax[0].plot( df_temp[ (df_temp.stationlat>=0) ].groupby('year').mean().iloc[:,0:12].mean(axis=1), ls='-', lw=1, color='blue', label='CRUTEM')
-ax[0].plot( df_temp_ebc[ (df_temp_ebc.stationlat>=0) ].groupby('year').mean().iloc[:,0:12].mean(axis=1), ls='-', lw=1, color='red', label='CRUTEM (EBC)')
+ax[0].plot( nh_temp.mean(axis=1), ls='-', lw=1, color='blue', label='CRUTEM')
+ax[0].plot( nh_temp_ebc.mean(axis=1), ls='-', lw=1, color='red', label='CRUTEM (EBC)')
 ax[0].tick_params(labelsize=fontsize)    
 ax[0].legend(loc='lower right', ncol=4, fontsize=12)
 ax[0].set_xlabel(xstr, fontsize=fontsize)
 ax[0].set_ylabel(ystr, fontsize=fontsize)
 ax[0].set_title( 'NH mean temperature: unweighted', fontsize=fontsize)
-ax[1].plot( df_temp[ (df_temp.stationlat<0) ].groupby('year').mean().iloc[:,0:12].mean(axis=1), ls='-', lw=1, color='blue', label='CRUTEM')
-ax[1].plot( df_temp_ebc[ (df_temp_ebc.stationlat<0) ].groupby('year').mean().iloc[:,0:12].mean(axis=1), ls='-', lw=1, color='red', label='CRUTEM (EBC)')
+ax[1].plot( sh_temp.mean(axis=1), ls='-', lw=1, color='blue', label='CRUTEM')
+ax[1].plot( sh_temp_ebc.mean(axis=1), ls='-', lw=1, color='red', label='CRUTEM (EBC)')
 ax[1].tick_params(labelsize=fontsize)    
 ax[1].legend(loc='lower right', ncol=4, fontsize=12)
 ax[1].set_xlabel(xstr, fontsize=fontsize)
@@ -106,8 +101,8 @@ ystr = 'Bias, °C'
 
 fig, ax = plt.subplots(2,1,sharex=True,figsize=(15,10))          
 for i in range(12):    
-    ax[0].plot( df_ebc[ (df_ebc.stationlat>=0) ].groupby('year').mean().iloc[:,i], label='Month '+str(i+1))
-ax[0].plot( df_ebc[ (df_ebc.stationlat>=0) ].groupby('year').mean().iloc[:,0:12].mean(axis=1), ls='-', lw=3, color='black', label='Annual')
+    ax[0].plot( nh_ebc.iloc[:,i], label='Month '+str(i+1))
+ax[0].plot( nh_ebc.mean(axis=1), ls='-', lw=3, color='black', label='Annual')
 ax[0].tick_params(labelsize=fontsize)    
 ax[0].legend(loc='lower right', ncol=4, fontsize=12)
 ax[0].set_xlabel(xstr, fontsize=fontsize)
@@ -115,8 +110,8 @@ ax[0].set_ylabel(ystr, fontsize=fontsize)
 ax[0].set_title( 'NH mean EBC: unweighted', fontsize=fontsize)
 ax[0].set_ylim(-0.1,0.1)
 for i in range(12):    
-    ax[1].plot( df_ebc[ (df_ebc.stationlat<0) ].groupby('year').mean().iloc[:,i], label='Month '+str(i+1))
-ax[1].plot( df_ebc[ (df_ebc.stationlat<0) ].groupby('year').mean().iloc[:,0:12].mean(axis=1), ls='-', lw=3, color='black', label='Annual')
+    ax[1].plot( sh_ebc.iloc[:,i], label='Month '+str(i+1))
+ax[1].plot( sh_ebc.mean(axis=1), ls='-', lw=3, color='black', label='Annual')
 ax[1].tick_params(labelsize=fontsize)    
 ax[1].legend(loc='lower right', ncol=4, fontsize=12)
 ax[1].set_xlabel(xstr, fontsize=fontsize)
@@ -131,6 +126,12 @@ plt.close(fig)
 #------------------------------------------------------------------------------
 
 if plot_random_stations == True:
+
+    # LOAD: station tables ( only needed for the per-station plots )
+
+    df_temp = read_frame( df_temp_file, years=( tstart, tend ) )
+    df_temp_ebc = read_frame( df_temp_ebc_file, years=( tstart, tend ) )
+    df_ebm = read_frame( df_ebm_file, columns=[ 'stationcode' ] )
     
     # SAMPLE: n random stationcodes
         
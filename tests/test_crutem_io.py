@@ -0,0 +1,42 @@
+#------------------------------------------------------------------------------
+# TESTS: crutem_io.py
+#------------------------------------------------------------------------------
+import numpy as np
+from crutem_io import build_stat4_index, format_station, read_crutem, to_crutem_integers
+
+header = '{code} 188 1304   10 STATION 0             COUNTRY        18502019  341850  -999.0\n'
+
+def test_stat4_index_tolerates_malformed_coordinates( tmp_path ):
+
+    stat4file = tmp_path / 'stat4.txt'
+    rows = '1850' + '  100' * 12 + '\n'
+    stat4file.write_text( header.format( code='010010' ).replace( ' 1304', ' 13X4' ) + rows + header.format( code='010020' ) + rows )
+
+    df = build_stat4_index( str( stat4file ) )
+
+    assert list( df.stationcode ) == [ '010010', '010020' ]
+    assert np.isnan( df.lon.iloc[0] ) & ( df.lat.iloc[0] == 18.8 )
+    assert df.lon.iloc[1] == 130.4
+
+def test_read_crutem_round_trips_merged_fields( tmp_path ):
+
+    rng = np.random.default_rng( 20221018 )
+    years = np.arange( 1850, 1860 )
+    data = rng.uniform( -9.999, 30.0, ( 2, len( years ), 12 ) )
+    data[0,0,:3] = [ -1.356, -9.999, -1.0 ] # fields <= -1000 run into the previous one
+    data[1,2,5] = np.nan
+
+    crutemfile = tmp_path / 'crutem.txt'
+    codes = [ '010010', '010020' ]
+    with open( crutemfile, 'w' ) as f:
+        for code, station_data in zip( codes, data ):
+            f.write( format_station( header.format( code=code ), years, station_data ) )
+    assert '-1356-9999-1000' in crutemfile.read_text()
+
+    df, t, values, mask = read_crutem( str( crutemfile ) )
+
+    assert list( df.stationcode ) == codes
+    assert list( t ) == list( years )
+    assert np.array_equal( values, to_crutem_integers( data ) )
+    assert np.array_equal( mask, np.isnan( data ) )
+    assert list( build_stat4_index( str( crutemfile ) ).stationcode ) == codes
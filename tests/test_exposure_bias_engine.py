@@ -0,0 +1,91 @@
+#------------------------------------------------------------------------------
+# TESTS: exposure_bias_engine.py
+#------------------------------------------------------------------------------
+import numpy as np
+import pandas as pd
+import multiprocessing
+from exposure_bias_engine import apply_exposure_bias, parallel_exposure_bias
+
+def synthetic_frames( nstations=40, nyears=30, seed=0 ):
+
+    rng = np.random.default_rng( seed )
+    codes = np.array( [ '%06d' % i for i in range( nstations ) ] )
+
+    df_temp = pd.DataFrame( {'year':np.tile( np.arange( 1900, 1900+nyears ), nstations ), 'stationcode':np.repeat( codes, nyears )} )
+    for month in range(1,13): df_temp[ str(month) ] = rng.normal( size=len( df_temp ) )
+    df_temp = df_temp.sample( frac=1, random_state=seed )
+
+    modelled = codes[::2]
+    df_ebm = pd.DataFrame( {'stationcode':np.repeat( modelled, nyears*12 ), 'datetime':np.tile( pd.date_range( '1895-01-01', periods=nyears*12, freq='MS' ), len( modelled ) ), 'bias':rng.normal( size=len( modelled )*nyears*12 )} )
+
+    return df_temp, df_ebm
+
+def baseline_exposure_bias( df_temp, df_ebm ):
+
+    '''
+    The original per-station loop of exposure-bias-correction.py: the model
+    months of each station are added to its temperature rows by position.
+    '''
+
+    df_ebc = df_temp.copy()
+    for i in range(1,13): df_ebc[str(i)] = 0.0
+    df_temp_ebc = df_temp.copy()
+    stationcodes_ebm = df_ebm.stationcode.unique()
+
+    for code in df_temp.stationcode.unique():
+        if code in stationcodes_ebm:
+            da = df_ebm[ df_ebm.stationcode == code ].reset_index(drop=True)
+            da.datetime = pd.date_range(start=str(da.datetime.loc[0].year), periods=len(da), freq='MS')
+            idx = df_temp_ebc[ df_temp_ebc.stationcode == code ].index.values
+            for i in range(1,13):
+                df_temp_ebc.loc[ idx, str(i) ] = df_temp_ebc.loc[ idx, str(i) ].values + da[ da.datetime.dt.month == i ].bias.values
+                df_ebc.loc[ idx, str(i) ] = df_ebc.loc[ idx, str(i) ].values + da[ da.datetime.dt.month == i ].bias.values
+
+    return df_temp_ebc, df_ebc
+
+def test_correction_matches_baseline_loop():
+
+    # FIXTURE: station rows in year order and model months covering exactly those years ( where matching by year and by position agree )
+
+    df_temp, df_ebm = synthetic_frames( nstations=12, nyears=6 )
+    df_temp = df_temp.sort_values( [ 'stationcode', 'year' ] ).reset_index(drop=True)
+    df_ebm['datetime'] = np.tile( pd.date_range( '1900-01-01', periods=6*12, freq='MS' ), df_ebm.stationcode.nunique() )
+
+    df_temp_ebc, df_ebc = apply_exposure_bias( df_temp, df_ebm )
+    baseline_temp_ebc, baseline_ebc = baseline_exposure_bias( df_temp, df_ebm )
+
+    pd.testing.assert_frame_equal( df_temp_ebc, baseline_temp_ebc )
+    pd.testing.assert_frame_equal( df_ebc, baseline_ebc )
+
+def test_correction_matches_rows_by_year():
+
+    # SHUFFLED: rows are matched by year, so any row order gives the year-ordered result ( the baseline loop matched by position )
+
+    df_temp, df_ebm = synthetic_frames( nstations=12, nyears=6 )
+    df_ebm['datetime'] = np.tile( pd.date_range( '1900-01-01', periods=6*12, freq='MS' ), df_ebm.stationcode.nunique() )
+    df_sorted = df_temp.sort_values( [ 'stationcode', 'year' ] )
+
+    df_temp_ebc, df_ebc = apply_exposure_bias( df_temp, df_ebm )
+    sorted_temp_ebc, sorted_ebc = apply_exposure_bias( df_sorted, df_ebm )
+
+    pd.testing.assert_frame_equal( df_ebc.loc[ df_sorted.index ], sorted_ebc )
+    assert not np.allclose( baseline_exposure_bias( df_temp.reset_index(drop=True), df_ebm )[1][ [ str(i) for i in range(1,13) ] ].values, df_ebc[ [ str(i) for i in range(1,13) ] ].values )
+
+def test_parallel_correction_matches_serial():
+
+    df_temp, df_ebm = synthetic_frames()
+    df_temp_ebc, df_ebc = apply_exposure_bias( df_temp, df_ebm )
+
+    for nworkers in [ 1, 3 ]:
+        parallel_temp_ebc, parallel_ebc = parallel_exposure_bias( df_temp, df_ebm, nworkers=nworkers )
+        pd.testing.assert_frame_equal( parallel_temp_ebc, df_temp_ebc )
+        pd.testing.assert_frame_equal( parallel_ebc, df_ebc )
+
+def test_parallel_correction_under_spawn():
+
+    df_temp, df_ebm = synthetic_frames( nstations=10, nyears=5 )
+    df_temp_ebc, df_ebc = apply_exposure_bias( df_temp, df_ebm )
+
+    parallel_temp_ebc, parallel_ebc = parallel_exposure_bias( df_temp, df_ebm, nworkers=2, mp_context=multiprocessing.get_context( 'spawn' ) )
+    pd.testing.assert_frame_equal( parallel_temp_ebc, df_temp_ebc )
+    pd.testing.assert_frame_equal( parallel_ebc, df_ebc )
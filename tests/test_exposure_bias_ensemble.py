@@ -0,0 +1,80 @@
+#------------------------------------------------------------------------------
+# TESTS: exposure_bias_ensemble.py
+#------------------------------------------------------------------------------
+import numpy as np
+from scipy import stats
+from exposure_bias_ensemble import sample_equiprobable_bins, stream_equiprobable_bins
+
+def generate_ensemble_members_rejection( nensemble, uncertainty, ndraws=1000000, rng=None ):
+
+    '''
+    Reference equiprobable binning by rejection: draw ndraws normals and pick
+    one at random from those falling in each bin ( the original method ).
+    '''
+
+    if rng is None: rng = np.random.default_rng()
+
+    random_numbers = rng.normal(loc=0, scale=uncertainty, size=ndraws)
+    bin_edges = np.linspace( -uncertainty, uncertainty, nensemble+1 )
+
+    bias_ensemble = []
+    for k in range(nensemble):
+
+        random_numbers_bin = random_numbers[ ( random_numbers > bin_edges[k] ) & ( random_numbers < bin_edges[k+1] ) ]
+        random_draw = rng.integers(len(random_numbers_bin))
+        random_bias = random_numbers_bin[ random_draw ]
+
+        bias_ensemble.append( random_bias )
+
+    return bias_ensemble
+
+def check_sampler_equivalence( nensemble=10, uncertainty=0.2, nsamples=2000, alpha=0.001, seed=None ):
+
+    '''
+    Statistical equivalence of the inverse-CDF sampler and the rejection
+    method: two-sample Kolmogorov-Smirnov test per bin.
+
+    seed: seed of both samplers ( None --> fresh entropy )
+    Returns: list of (bin, KS statistic, p-value), True if no bin rejects at alpha
+    '''
+
+    rng = np.random.default_rng( seed )
+
+    draws_rejection = np.array( [ generate_ensemble_members_rejection( nensemble, uncertainty, ndraws=100000, rng=rng ) for i in range(nsamples) ] )
+    draws_inverse_cdf = sample_equiprobable_bins( np.full( nsamples, uncertainty ), nensemble, rng=rng )
+
+    results = []
+    for k in range(nensemble):
+        statistic, pvalue = stats.ks_2samp( draws_rejection[:,k], draws_inverse_cdf[:,k] )
+        results.append( ( k, statistic, pvalue ) )
+
+    return results, all( pvalue > alpha for k, statistic, pvalue in results )
+
+def test_draws_fall_in_their_bins():
+
+    uncertainty = 0.2
+    draws = sample_equiprobable_bins( np.full( 1000, uncertainty ), 10, rng=np.random.default_rng( 1 ) )
+    edges = np.linspace( -uncertainty, uncertainty, 11 )
+
+    assert draws.shape == ( 1000, 10 )
+    assert np.all( ( draws >= edges[:-1] ) & ( draws <= edges[1:] ) )
+
+def test_sampler_equivalent_to_rejection():
+
+    results, passed = check_sampler_equivalence( nsamples=500, alpha=0.001, seed=20220503 )
+
+    assert passed, results
+
+def test_stream_subsets_match_full_run():
+
+    nensemble = 20
+    codes = [ '%06d' % i for i in range( 50 ) ]
+    uncertainties = np.where( np.arange( 50 ) % 3 == 0, 0.1, 0.2 )
+    full = stream_equiprobable_bins( uncertainties, nensemble, codes, seed=7 )
+
+    members = [ 17, 3, 11 ]
+    stations = [ 49, 0, 22, 23 ]
+    subset = stream_equiprobable_bins( uncertainties[ stations ], nensemble, [ codes[k] for k in stations ], members, seed=7 )
+
+    assert subset.tobytes() == full[ np.ix_( stations, members ) ].tobytes()
+    assert stream_equiprobable_bins( uncertainties, nensemble, codes, seed=8 ).tobytes() != full.tobytes()